@@ -1,30 +1,105 @@
+from __future__ import annotations
+
+import time
+
+_PROCESS_T0 = time.perf_counter()
+
 import os
 import re
+import sys
+import io
 import json
 import random
 import asyncio
 import shutil
+import tempfile
+import threading
+import functools
+import hashlib
+import bisect
+import heapq
+import importlib
+import sqlite3
+import atexit
+import signal
+import weakref
+import statistics
+import subprocess
+import urllib.request
+from array import array
+from collections import deque, OrderedDict
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dataclasses import dataclass
+from urllib.parse import urlparse, parse_qs
 from typing import Optional, List, Tuple, Dict
 
 import aiohttp
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-import yt_dlp
 
-from PIL import Image, ImageDraw, ImageFont
-import arabic_reshaper
-from bidi.algorithm import get_display
+# =========================
+# Startup timing + lazy imports
+# =========================
+class StartupTimer:
+    def __init__(self, t0: float):
+        self.t0 = t0
+        self.last = t0
+        self.phases: List[Tuple[str, float]] = []
+        self.reported = False
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def as_dict(self) -> dict:
+        d = {name: round(took, 4) for name, took in self.phases}
+        d["total"] = round(self.last - self.t0, 4)
+        return d
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        parts = " | ".join(f"{name} {took:.2f}s" for name, took in self.phases)
+        print(f"[STARTUP] {parts} | total {self.last - self.t0:.2f}s")
+
+STARTUP = StartupTimer(_PROCESS_T0)
+
+class LazyModule:
+    # يستورد الموديول أول مرة بينطلب منه شي (yt-dlp وPillow تقال وما بنحتاجهم وقت الإقلاع)
+    def __init__(self, name: str):
+        self._name = name
+        self._mod = None
+
+    def _load(self):
+        if self._mod is None:
+            started = time.perf_counter()
+            self._mod = importlib.import_module(self._name)
+            LAZY_IMPORT_TIMES[self._name] = time.perf_counter() - started
+        return self._mod
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+LAZY_IMPORT_TIMES: Dict[str, float] = {}
+
+yt_dlp = LazyModule("yt_dlp")
+Image = LazyModule("PIL.Image")
+ImageDraw = LazyModule("PIL.ImageDraw")
+ImageFont = LazyModule("PIL.ImageFont")
+arabic_reshaper = LazyModule("arabic_reshaper")
+bidi_algorithm = LazyModule("bidi.algorithm")
 
 # =========================
 # ENV
 # =========================
 load_dotenv()
+STARTUP.mark("imports")
 
 DISCORD_TOKEN = (os.getenv("DISCORD_TOKEN") or os.getenv("BOT_TOKEN") or "").strip()
-if not DISCORD_TOKEN:
-    raise SystemExit("❌ DISCORD_TOKEN is missing. Set it in Railway/Render Variables.")
 
 PREFIX = (os.getenv("PREFIX") or "!").strip() or "!"
 ENABLE_PREFIX_COMMANDS = (os.getenv("ENABLE_PREFIX_COMMANDS", "1").strip() == "1")
@@ -41,8 +116,9 @@ TEMPLATE_URL = (os.getenv("TEMPLATE_URL") or "https://i.postimg.cc/6p7DJpm6/qura
 ASSETS_DIR = "assets"
 TEMPLATE_PATH = os.path.join(ASSETS_DIR, "quran-template.png")
 
-# خط عربي (إذا موجود بالنظام أو بالمجلد assets/fonts)
+# خط عربي: FONT_PATH إذا محدد، وإلا assets/fonts أو النظام
 # (Dockerfile رح يثبت fonts-amiri غالبًا)
+FONT_PATH = (os.getenv("FONT_PATH") or "").strip()
 FALLBACK_FONT_PATHS = [
     os.path.join(ASSETS_DIR, "fonts", "Amiri-Regular.ttf"),
     "/usr/share/fonts/truetype/amiri/Amiri-Regular.ttf",
@@ -53,6 +129,133 @@ FALLBACK_FONT_PATHS = [
 # left, top, right, bottom
 TEXT_BOX = (0.17, 0.37, 0.83, 0.63)
 
+# =========================
+# Metrics (Prometheus text format)
+# =========================
+# فاضي = ما في endpoint. مع الـ launcher كل process بتاخد PORT + رقمها
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_HOST = (os.getenv("METRICS_HOST") or "127.0.0.1").strip()
+
+def metric_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{metric_labels(k)} {v:g}" for k, v in items]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn=None):
+        super().__init__(name, help_text)
+        # fn بترجع رقم أو dict {labels tuple: value} وقت الـ scrape
+        self.fn = fn
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> List[str]:
+        if self.fn is None:
+            return [f"{self.name} {self.value:g}"]
+        got = self.fn()
+        if isinstance(got, dict):
+            return [f"{self.name}{metric_labels(k)} {v:g}" for k, v in got.items()]
+        return [f"{self.name} {got:g}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if i < len(self.counts):
+                self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        out = []
+        acc = 0
+        for le, c in zip(self.buckets, counts):
+            acc += c
+            out.append(f'{self.name}_bucket{{le="{le:g}"}} {acc}')
+        out.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        out.append(f"{self.name}_sum {total:g}")
+        out.append(f"{self.name}_count {count}")
+        return out
+
+METRICS: List[Metric] = []
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for m in METRICS:
+        try:
+            samples = m.samples()
+        except Exception as e:
+            print(f"[METRICS] {m.name}: {type(e).__name__}: {e}")
+            continue
+        lines.extend(m.header())
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+EXTRACT_SECONDS = Histogram("quranbot_extract_seconds", "yt-dlp extract_info duration", LATENCY_BUCKETS)
+EXTRACT_FAILURES = Counter("quranbot_extract_failures_total", "yt-dlp extractions that returned nothing or raised")
+SOURCE_FAILURES = Counter("quranbot_create_source_failures_total", "Tracks skipped because create_source failed")
+GAP_SECONDS = Histogram("quranbot_track_gap_seconds", "Silence between the end of one track and the start of the next", LATENCY_BUCKETS)
+RENDER_SECONDS = Histogram("quranbot_card_render_seconds", "Card render time in the render pool", LATENCY_BUCKETS)
+UPLOAD_SECONDS = Histogram("quranbot_card_upload_seconds", "Time to upload one card to one channel", LATENCY_BUCKETS)
+UPLOAD_FAILURES = Counter("quranbot_card_upload_failures_total", "Card uploads that raised")
+LOOP_LAG_SECONDS = Histogram("quranbot_event_loop_lag_seconds", "Event loop scheduling lag", (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+STREAM_RESUMES = Counter("quranbot_stream_resumes_total", "Tracks re-resolved and resumed with a seek after the stream ended early")
+BREAKER_TRIPS = Counter("quranbot_extract_breaker_trips_total", "Times YouTube rate-limiting paused all extraction")
+VOICE_EVENTS = Counter("quranbot_voice_events_total", "Bot voice connects/reconnects/disconnects and restore failures")
+
 # =========================
 # روابط القرآن (أضفت كثير + خليت روابطك)
 # =========================
@@ -114,19 +317,37 @@ DEFAULT_SONG_URLS = [
 
 URL_RE = re.compile(r"^https?://", re.IGNORECASE)
 
+def is_search(url: str) -> bool:
+    return url.lower().startswith("ytsearch")
+
+def is_playlist_url(url: str) -> bool:
+    # youtube.com/playlist?list=... أو watch?v=...&list=... (noplaylist=False => القائمة كلها)
+    if not URL_RE.match(url):
+        return False
+    return "list" in parse_qs(urlparse(url).query)
+
+def entry_url(entry: dict) -> Optional[str]:
+    # نتيجة flat أو بحث => رابط الفيديو
+    url = entry.get("webpage_url") or entry.get("url")
+    if entry.get("id") and (not url or not URL_RE.match(url)):
+        url = f"https://www.youtube.com/watch?v={entry['id']}"
+    return url
+
 # =========================
 # yt-dlp + ffmpeg
 # =========================
 def has_cmd(cmd: str) -> bool:
     return shutil.which(cmd) is not None
 
-def pick_js_runtimes() -> List[str]:
+@functools.lru_cache(maxsize=None)
+def pick_js_runtimes() -> Tuple[str, ...]:
+    # shutil.which بيفتش الـ PATH كل مرة، والنتيجة ما بتتغير وقت التشغيل
     r = []
     if has_cmd("deno"):
         r.append("deno")
     if has_cmd("node"):
         r.append("node")
-    return r
+    return tuple(r)
 
 BASE_YTDL_OPTS = {
     "format": "bestaudio/best",
@@ -146,55 +367,787 @@ BASE_YTDL_OPTS = {
 FFMPEG_BEFORE = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
 FFMPEG_OPTS = "-vn"
 
-def make_ytdl() -> yt_dlp.YoutubeDL:
+# "opus": ffmpeg بيطلع Opus جاهز والصوت بيتظبط جوا ffmpeg (أخف بكتير عالـ CPU)
+# "pcm": الطريقة القديمة (PCM + PCMVolumeTransformer) إذا بدك تغيّر الصوت وقت التشغيل
+AUDIO_PATH = (os.getenv("AUDIO_PATH") or "opus").strip().lower()
+OPUS_BITRATE = int(os.getenv("OPUS_BITRATE", "128"))
+# الصوت الافتراضي للتشغيل والراديو (نفس القديم 0.6)
+# VOLUME=1.0 مع AUDIO_PATH=opus => المقاطع اللي هي Opus أصلاً بتنسخ بدون decode/encode (أخف شي عالـ CPU)
+# بس الصوت بيعلى؛ أي قيمة غير 1.0 بترجع الـ transcode مع filter الصوت
+DEFAULT_VOLUME = float(os.getenv("VOLUME", "0.6"))
+
+# يفتح ffmpeg للمقطع الجاي مسبقاً (مش بس يجيب الرابط) => انتقال فوري بس عملية زيادة لكل سيرفر
+PREFETCH_FFMPEG = (os.getenv("PREFETCH_FFMPEG", "0").strip() == "1")
+
+# بحث/قوائم بدون ما نجيب الـ formats لكل نتيجة (أسرع بكتير)
+FLAT_YTDL_OPTS = {"extract_flat": "in_playlist"}
+
+class YtdlLogger:
+    # مع ignoreerrors yt-dlp بيرجع None بدون exception، فمنلقط نص الخطأ هون (لكل thread)
+    local = threading.local()
+
+    def debug(self, msg: str):
+        pass
+
+    def info(self, msg: str):
+        pass
+
+    def warning(self, msg: str):
+        pass
+
+    def error(self, msg: str):
+        self.local.last_error = msg
+
+    def take_error(self) -> str:
+        msg = getattr(self.local, "last_error", "") or ""
+        self.local.last_error = ""
+        return msg
+
+YTDL_LOGGER = YtdlLogger()
+
+def make_ytdl(extra: Optional[dict] = None) -> yt_dlp.YoutubeDL:
     opts = dict(BASE_YTDL_OPTS)
+    opts["logger"] = YTDL_LOGGER
+    if extra:
+        opts.update(extra)
     runtimes = pick_js_runtimes()
     if runtimes:
-        opts["js_runtimes"] = runtimes
+        opts["js_runtimes"] = list(runtimes)
     try:
         return yt_dlp.YoutubeDL(opts)
     except Exception:
         opts.pop("js_runtimes", None)
         return yt_dlp.YoutubeDL(opts)
 
+# =========================
+# Pool خاص لـ yt-dlp (مش الـ default executor تبع discord/aiohttp)
+# =========================
+EXTRACT_WORKERS = max(1, int(os.getenv("EXTRACT_WORKERS", "4")))
+# بعد كم استخراج نبدّل نسخة YoutubeDL (مشان الذاكرة ما تكبر للأبد)
+EXTRACT_RECYCLE_AFTER = int(os.getenv("EXTRACT_RECYCLE_AFTER", "200"))
+# أقصى عدد مقاطع منضيفها من قائمة يوتيوب وحدة
+PLAYLIST_MAX_ITEMS = int(os.getenv("PLAYLIST_MAX_ITEMS", "500"))
+
+class ExtractorPool:
+    def __init__(self, workers: int = EXTRACT_WORKERS):
+        self.workers = workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.pending = 0
+        self.running = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ytdl")
+        return self.executor
+
+    def _ydl(self, flat: bool) -> yt_dlp.YoutubeDL:
+        # نسخة YoutubeDL وحدة لكل thread (ولكل نوع: عادي/flat)، بتضل عايشة بين الطلبات
+        if not hasattr(self.local, "ydls"):
+            self.local.ydls = {}
+            self.local.uses = {}
+        ydl = self.local.ydls.get(flat)
+        uses = self.local.uses.get(flat, 0)
+        if ydl is None or uses >= EXTRACT_RECYCLE_AFTER > 0:
+            if ydl is not None:
+                try:
+                    ydl.close()
+                except Exception:
+                    pass
+            ydl = make_ytdl(FLAT_YTDL_OPTS if flat else None)
+            self.local.ydls[flat] = ydl
+            uses = 0
+        self.local.uses[flat] = uses + 1
+        return ydl
+
+    def _run(self, url: str, flat: bool, submitted: float) -> Optional[dict]:
+        started = time.monotonic()
+        with self.lock:
+            self.running += 1
+        ok = False
+        YTDL_LOGGER.take_error()
+        try:
+            info = self._ydl(flat).extract_info(url, download=False)
+        except Exception as e:
+            FAILURES.failed(url, str(e))
+            raise
+        else:
+            ok = info is not None
+            if ok:
+                FAILURES.succeeded(url)
+            else:
+                FAILURES.failed(url, YTDL_LOGGER.take_error() or "no info")
+            return info
+        finally:
+            took = time.monotonic() - started
+            EXTRACT_SECONDS.observe(took)
+            if not ok:
+                EXTRACT_FAILURES.inc(kind="flat" if flat else "full")
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                if not ok:
+                    self.failures += 1
+                self.total_wait += started - submitted
+                self.total_time += took
+                self.max_time = max(self.max_time, took)
+
+    async def extract(self, url: str, flat: bool = False) -> Optional[dict]:
+        # يوتيوب عم يحدّ الطلبات أو الرابط معروف إنه خربان؟ لا تضيّع worker عليه
+        FAILURES.check(url)
+        # نفس الرابط قيد الاستخراج؟ استنى نفس النتيجة بدل ما نعيد الشغل
+        key = ("flat:" if flat else "") + url
+        fut = self.inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.get_executor(), self._run, url, flat, time.monotonic())
+        self.inflight[key] = fut
+        self.pending += 1
+
+        def _done(_):
+            self.pending -= 1
+            self.inflight.pop(key, None)
+
+        fut.add_done_callback(_done)
+        return await asyncio.shield(fut)
+
+    def _stream(self, url: str, emit, stopped, submitted: float) -> int:
+        # process=False: الـ entries بتيجي generator صفحة صفحة، منبعت كل وحدة للـ loop أول ما توصل
+        started = time.monotonic()
+        with self.lock:
+            self.running += 1
+        count = 0
+        YTDL_LOGGER.take_error()
+        try:
+            ydl = self._ydl(True)
+            info = ydl.extract_info(url, download=False, process=False)
+            # process=False ما بيلحق التحويلات: watch?v=..&list=.. (youtube:tab) و youtu.be/..?list=..
+            # بيرجعوا _type=url لـ /playlist?list=..، فمنلحقهم لحد ما توصل القائمة (أو المقطع) الحقيقية
+            hops = 0
+            while info and info.get("_type") in ("url", "url_transparent") and info.get("url") and hops < 5:
+                info = ydl.extract_info(info["url"], ie_key=info.get("ie_key"), download=False, process=False)
+                hops += 1
+            if not info:
+                FAILURES.failed(url, YTDL_LOGGER.take_error() or "no info")
+                return 0
+            entries = info.get("entries")
+            if entries is None:
+                # مش قائمة أصلاً: مقطع واحد
+                emit(info.get("webpage_url") or url, info.get("title"), info.get("duration"))
+                return 1
+            for entry in entries:
+                if stopped() or count >= PLAYLIST_MAX_ITEMS:
+                    break
+                if not entry:
+                    continue
+                vid_url = entry_url(entry)
+                if not vid_url:
+                    continue
+                emit(vid_url, entry.get("title"), entry.get("duration"))
+                count += 1
+            FAILURES.succeeded(url)
+            return count
+        finally:
+            took = time.monotonic() - started
+            EXTRACT_SECONDS.observe(took)
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_wait += started - submitted
+                self.total_time += took
+                self.max_time = max(self.max_time, took)
+
+    async def stream_entries(self, url: str, on_entry, stopped=lambda: False) -> int:
+        # on_entry(url, title, duration) بتنادى على الـ loop، بنفس ترتيب القائمة
+        FAILURES.check(url)
+        loop = asyncio.get_running_loop()
+
+        def _emit(*args):
+            loop.call_soon_threadsafe(on_entry, *args)
+
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self.get_executor(), self._stream, url, _emit, stopped, time.monotonic())
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        n = self.completed or 1
+        return {
+            "workers": self.workers,
+            "queued": max(0, self.pending - self.running),
+            "running": self.running,
+            "completed": self.completed,
+            "failures": self.failures,
+            "coalesced": self.coalesced,
+            "avg_wait": self.total_wait / n,
+            "avg_time": self.total_time / n,
+            "max_time": self.max_time,
+        }
+
+EXTRACTOR = ExtractorPool()
+
+# =========================
+# كاش روابط الستريم (مشترك بين كل السيرفرات)
+# =========================
+# إذا رابط الستريم ما فيه expire= نعتبره صالح لهالمدة (ثواني)
+STREAM_CACHE_TTL = int(os.getenv("STREAM_CACHE_TTL", "18000"))
+# نعتبر الرابط منتهي قبل وقته بشوي مشان ما ينقطع بنص التشغيل
+STREAM_CACHE_MARGIN = int(os.getenv("STREAM_CACHE_MARGIN", "600"))
+
+EXPIRE_PATH_RE = re.compile(r"/expire/(\d+)")
+
+@dataclass
+class ResolvedStream:
+    video_url: str
+    title: str
+    stream_url: str
+    expires_at: float
+    acodec: str = ""
+    is_live: bool = False
+    # stream_url ملف محلي (من كاش الصوت) مش رابط
+    local: bool = False
+    duration: Optional[float] = None
+
+    @property
+    def before_options(self) -> str:
+        return "" if self.local else FFMPEG_BEFORE
+
+    def before_options_at(self, start: float) -> str:
+        # -ss قبل -i: ffmpeg بيطلب من النقطة مباشرة (range request) بدون ما ينزّل اللي قبلها
+        if start <= 0 or self.is_live:
+            return self.before_options
+        return f"{self.before_options} -ss {start:.2f}".strip()
+
+def stream_expiry(stream_url: str) -> float:
+    # googlevideo بيحط وقت الانتهاء (epoch) كـ expire= أو /expire/<ts>/
+    try:
+        exp = parse_qs(urlparse(stream_url).query).get("expire")
+        if exp:
+            return float(exp[0])
+    except ValueError:
+        pass
+    m = EXPIRE_PATH_RE.search(stream_url)
+    if m:
+        return float(m.group(1))
+    return time.time() + STREAM_CACHE_TTL
+
+class StreamCache:
+    def __init__(self, margin: int = STREAM_CACHE_MARGIN):
+        self.margin = margin
+        self.entries: Dict[str, ResolvedStream] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: str) -> Optional[ResolvedStream]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at - self.margin <= time.time():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: ResolvedStream):
+        self.entries[key] = entry
+        if len(self.entries) > 512:
+            self.purge()
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+    def purge(self):
+        now = time.time()
+        for k in [k for k, e in self.entries.items() if e.expires_at - self.margin <= now]:
+            del self.entries[k]
+            self.expired += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+        }
+
+STREAM_CACHE = StreamCache()
+
+async def resolve_stream(url: str) -> ResolvedStream:
+    cached = STREAM_CACHE.get(url)
+    if cached:
+        return cached
+
+    # بحث معروف؟ روح عالفيديو مباشرة بدون بحث يوتيوب
+    known = SEARCH_INDEX.lookup(url) if is_search(url) else None
+    if known:
+        try:
+            resolved = await resolve_stream(known["url"])
+        except ExtractorBusy:
+            # القاطع مفتوح: لا تحذف ولا تبحث، نفس الإدخال بيشتغل لما يرجع يوتيوب
+            raise
+        except Exception as e:
+            # timeout/شبكة/429: الفيديو لسا موجود، خلي الإدخال والخطأ يطلع
+            # بس إذا الفيديو نفسه انحذف/موقوف (FAILURES صنّفه "url") منرجع نبحث
+            if not FAILURES.quarantined(known["url"]):
+                raise
+            print(f"[SEARCH INDEX] stale entry for {url}: {e}")
+            SEARCH_INDEX.forget(url)
+        else:
+            if not resolved.title:
+                resolved.title = known.get("title") or ""
+            STREAM_CACHE.put(url, resolved)
+            return resolved
+
+    # رابط قائمة وصل لهون (مش من /play): flat بدل ما نستخرج formats لكل المقاطع
+    info = await EXTRACTOR.extract(url, flat=is_playlist_url(url))
+    if not info:
+        # القاطع فتح أو الرابط انوقف هلق؟ نفس الخطأ اللي رح يطلع للطلبات الجاية
+        FAILURES.check(url)
+        raise RuntimeError("فشل استخراج معلومات من yt-dlp.")
+
+    # playlist/search
+    if "entries" in info and info["entries"]:
+        entry = next((e for e in info["entries"] if e), None)
+        if not entry:
+            raise RuntimeError("ما لقيت نتيجة صالحة.")
+        vid_url = entry_url(entry)
+        if not vid_url:
+            raise RuntimeError("نتيجة بدون رابط.")
+        if is_search(url):
+            SEARCH_INDEX.record(url, entry, vid_url)
+        try:
+            resolved = await resolve_stream(vid_url)
+        except Exception as e:
+            # البحث بيوصل لفيديو خربان: وقّف البحث كمان (وإلا كل سيرفر بيرجع يجربه)
+            if is_search(url) and not isinstance(e, ExtractorBusy) and FAILURES.quarantined(vid_url):
+                FAILURES.failed(url, FAILURES.reason(vid_url))
+            raise
+        if not resolved.title:
+            resolved.title = entry.get("title") or ""
+        STREAM_CACHE.put(url, resolved)
+        return resolved
+
+    stream_url = info.get("url")
+    acodec = info.get("acodec") or ""
+    if not stream_url and info.get("requested_formats"):
+        fmt = info["requested_formats"][0]
+        stream_url = fmt.get("url")
+        acodec = fmt.get("acodec") or acodec
+    if not stream_url:
+        raise RuntimeError("ما حصلت رابط ستريم صالح.")
+
+    resolved = ResolvedStream(
+        video_url=url,
+        title=info.get("title") or "",
+        stream_url=stream_url,
+        expires_at=stream_expiry(stream_url),
+        acodec=acodec if acodec != "none" else "",
+        is_live=bool(info.get("is_live")),
+        duration=float(info["duration"]) if info.get("duration") else None,
+    )
+    STREAM_CACHE.put(url, resolved)
+    return resolved
+
 # =========================
 # تخزين إعدادات السيرفرات (روم الآيات + روم الصوت)
 # =========================
-DATA_DIR = "data"
-CFG_PATH = os.path.join(DATA_DIR, "guild_config.json")
+DATA_DIR = os.getenv("DATA_DIR", "data")
+CFG_PATH = os.path.join(DATA_DIR, "guild_config.json")  # القديم، بينقل تلقائياً
+CFG_DB_PATH = os.path.join(DATA_DIR, "guild_config.db")
+# التغييرات بتتجمع وبتنكتب دفعة وحدة بعد هالقد ثواني
+CONFIG_FLUSH_SECONDS = float(os.getenv("CONFIG_FLUSH_SECONDS", "2"))
 
 def ensure_dirs():
     os.makedirs(ASSETS_DIR, exist_ok=True)
     os.makedirs(DATA_DIR, exist_ok=True)
 
-def load_config() -> Dict[str, dict]:
-    ensure_dirs()
-    if not os.path.exists(CFG_PATH):
-        return {}
-    try:
-        with open(CFG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+def default_gcfg() -> dict:
+    return {
+        "ayah_channel_id": None,
+        "voice_channel_id": None,
+        "autoplay_on_ready": False,
+    }
+
+class ConfigStore:
+    # SQLite (WAL): كل سيرفر صف لحاله => تعديل سيرفر = upsert صف واحد، مش إعادة كتابة الملف كله
+    def __init__(self, path: str):
+        self.path = path
+        self.db: Optional[sqlite3.Connection] = None
+        self.dirty: set = set()
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def open(self) -> sqlite3.Connection:
+        if self.db is not None:
+            return self.db
+        ensure_dirs()
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS guilds ("
+            " guild_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " autoplay INTEGER NOT NULL DEFAULT 0,"
+            " ayah INTEGER NOT NULL DEFAULT 0)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS guilds_autoplay ON guilds(guild_id) WHERE autoplay = 1")
+        db.execute("CREATE INDEX IF NOT EXISTS guilds_ayah ON guilds(guild_id) WHERE ayah = 1")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db = db
+        self.migrate_json(CFG_PATH)
+        return db
+
+    def migrate_json(self, json_path: str):
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                old = json.load(f)
+        except Exception as e:
+            print(f"[CONFIG] can't read {json_path}: {e}")
+            return
+        self.upsert([(int(k), v) for k, v in old.items()])
+        os.replace(json_path, json_path + ".migrated")
+        print(f"[CONFIG] migrated {len(old)} guilds from {json_path}")
+
+    @staticmethod
+    def row(guild_id: int, gcfg: dict) -> Tuple[int, str, int, int]:
+        autoplay = int(bool(gcfg.get("autoplay_on_ready") and gcfg.get("voice_channel_id")))
+        ayah = int(bool(gcfg.get("ayah_channel_id")))
+        return guild_id, json.dumps(gcfg, ensure_ascii=False, separators=(",", ":")), autoplay, ayah
+
+    def upsert(self, items: List[Tuple[int, dict]]):
+        if not items:
+            return
+        db = self.open()
+        with db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT INTO guilds (guild_id, data, autoplay, ayah) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(guild_id) DO UPDATE SET"
+                " data = excluded.data, autoplay = excluded.autoplay, ayah = excluded.ayah",
+                [self.row(gid, g) for gid, g in items],
+            )
+
+    def get(self, guild_id: int) -> Optional[dict]:
+        r = self.open().execute("SELECT data FROM guilds WHERE guild_id = ?", (guild_id,)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def autoplay_guild_ids(self) -> List[int]:
+        self.flush()
+        return [r[0] for r in self.open().execute("SELECT guild_id FROM guilds WHERE autoplay = 1")]
+
+    def ayah_guild_ids(self) -> List[int]:
+        self.flush()
+        return [r[0] for r in self.open().execute("SELECT guild_id FROM guilds WHERE ayah = 1")]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        r = self.open().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return r[0] if r else None
+
+    def set_meta(self, key: str, value: str):
+        self.open().execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
 
-def save_config(cfg: Dict[str, dict]):
-    ensure_dirs()
-    with open(CFG_PATH, "w", encoding="utf-8") as f:
-        json.dump(cfg, f, ensure_ascii=False, indent=2)
+    def mark_dirty(self, guild_id: int):
+        self.dirty.add(guild_id)
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self.flush_handle = loop.call_later(CONFIG_FLUSH_SECONDS, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.dirty:
+            return
+        ids, self.dirty = self.dirty, set()
+        try:
+            self.upsert([(gid, CFG[str(gid)]) for gid in ids if str(gid) in CFG])
+        except Exception as e:
+            print(f"[CONFIG] flush failed: {e}")
+            self.dirty |= ids
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
 
-CFG: Dict[str, dict] = load_config()
+CONFIG = ConfigStore(CFG_DB_PATH)
+atexit.register(CONFIG.close)
+
+# كاش بالذاكرة للسيرفرات اللي انقرت (مش كل السيرفرات)
+CFG: Dict[str, dict] = {}
 
 def get_gcfg(guild_id: int) -> dict:
     k = str(guild_id)
     if k not in CFG:
-        CFG[k] = {
-            "ayah_channel_id": None,
-            "voice_channel_id": None,
-            "autoplay_on_ready": False,
-        }
-        save_config(CFG)
+        # سيرفر جديد ما بينكتب عالديسك لين يتغير شي فيه
+        CFG[k] = CONFIG.get(guild_id) or default_gcfg()
     return CFG[k]
 
+def save_gcfg(guild_id: int):
+    CONFIG.mark_dirty(guild_id)
+
+# =========================
+# فهرس نتائج البحث (ytsearch1:...) محفوظ عالديسك
+# =========================
+SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search_index.json")
+SEARCH_INDEX_MAX = int(os.getenv("SEARCH_INDEX_MAX", "2000"))
+# كل كم ساعة نعيد البحث مشان لو الفيديو انحذف أو صار في نتيجة أحسن
+SEARCH_INDEX_REFRESH_HOURS = float(os.getenv("SEARCH_INDEX_REFRESH_HOURS", "24"))
+
+class SearchIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+
+    def load(self):
+        ensure_dirs()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print(f"[SEARCH INDEX] load failed: {e}")
+            self.entries = {}
+
+    def save(self):
+        ensure_dirs()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def lookup(self, query: str) -> Optional[dict]:
+        return self.entries.get(query)
+
+    def forget(self, query: str):
+        if self.entries.pop(query, None) is not None:
+            self.save()
+
+    def record(self, query: str, entry: dict, vid_url: str):
+        old = self.entries.get(query)
+        new = {
+            "id": entry.get("id"),
+            "url": vid_url,
+            "title": entry.get("title") or "",
+            "duration": entry.get("duration"),
+            "resolved_at": time.time(),
+        }
+        self.entries[query] = new
+        if len(self.entries) > SEARCH_INDEX_MAX:
+            oldest = min(self.entries, key=lambda k: self.entries[k].get("resolved_at", 0))
+            del self.entries[oldest]
+        if not old or old.get("url") != vid_url:
+            self.save()
+
+    async def refresh(self, queries: List[str]) -> int:
+        changed = 0
+        for q in queries:
+            try:
+                info = await EXTRACTOR.extract(q, flat=True)
+                entry = next((e for e in (info or {}).get("entries") or [] if e), None)
+                if not entry:
+                    continue
+                vid_url = entry_url(entry)
+                if not vid_url:
+                    continue
+                old = self.entries.get(q)
+                if not old or old.get("url") != vid_url:
+                    changed += 1
+                    STREAM_CACHE.invalidate(q)
+                self.record(q, entry, vid_url)
+            except ExtractorBusy as e:
+                print(f"[SEARCH INDEX] refresh paused: {e}")
+                break
+            except Exception as e:
+                print(f"[SEARCH INDEX] refresh failed for {q}: {e}")
+            # لا تضغط على يوتيوب
+            await asyncio.sleep(2)
+        self.save()
+        return changed
+
+SEARCH_INDEX = SearchIndex(SEARCH_INDEX_PATH)
+
+# =========================
+# روابط خربانة (backoff لكل رابط) + قاطع عام لما يوتيوب يحدّ الطلبات
+# =========================
+FAILURES_PATH = os.path.join(DATA_DIR, "failures.json")
+# أول فشل: هالقد ثواني، وبعدين بيتضاعف لين FAILURE_BACKOFF_MAX
+FAILURE_BACKOFF_BASE = float(os.getenv("FAILURE_BACKOFF_BASE", "300"))
+FAILURE_BACKOFF_MAX = float(os.getenv("FAILURE_BACKOFF_MAX", str(24 * 3600)))
+# 429 / "sign in to confirm": وقف كل الاستخراج هالقد (وبيتضاعف إذا رجع)
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "120"))
+BREAKER_COOLDOWN_MAX = float(os.getenv("BREAKER_COOLDOWN_MAX", "3600"))
+
+RATE_LIMIT_RE = re.compile(r"HTTP Error 429|Too Many Requests|Sign in to confirm|confirm you.re not a bot|rate.limit", re.I)
+NETWORK_ERROR_RE = re.compile(
+    r"Unable to download|timed out|Temporary failure|Name or service not known|Connection (reset|refused|aborted)|Network is unreachable",
+    re.I,
+)
+
+class ExtractorBusy(RuntimeError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"يوتيوب عم يحدّ الطلبات، رح نرجع نجرب بعد {int(retry_after)} ثانية.")
+        self.retry_after = retry_after
+
+class Quarantined(RuntimeError):
+    pass
+
+def classify_ytdl_error(msg: str) -> str:
+    if RATE_LIMIT_RE.search(msg):
+        return "ratelimit"
+    if NETWORK_ERROR_RE.search(msg) and "HTTP Error 4" not in msg:
+        return "network"
+    return "url"
+
+class FailureRegistry:
+    # مشترك بين كل السيرفرات: رابط فشل بسيرفر ما بيتجرب بالباقي لين يخلص الـ backoff
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        self.open_until = 0.0
+        self.trips = 0
+        self.last_trip_error = ""
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print(f"[FAILURES] load failed: {e}")
+            self.entries = {}
+
+    def save(self):
+        ensure_dirs()
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False)
+        tmp = self.path + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def quarantined(self, url: str) -> bool:
+        e = self.entries.get(url)
+        return bool(e) and e["until"] > time.time()
+
+    def reason(self, url: str) -> str:
+        e = self.entries.get(url)
+        return e["error"] if e else ""
+
+    def check(self, url: str):
+        now = time.time()
+        if self.open_until > now:
+            raise ExtractorBusy(self.open_until - now)
+        e = self.entries.get(url)
+        if e and e["until"] > now:
+            raise Quarantined(f"الرابط فاشل {e['fails']} مرة، موقوف لـ {int(e['until'] - now)} ثانية: {e['error']}")
+
+    def failed(self, url: str, msg: str):
+        # بيتنادى من threads تبع yt-dlp
+        msg = msg.replace("ERROR: ", "").strip()[:300]
+        kind = classify_ytdl_error(msg)
+        now = time.time()
+        if kind == "network":
+            return
+        if kind == "ratelimit":
+            with self.lock:
+                self.trips += 1
+                cooldown = min(BREAKER_COOLDOWN_MAX, BREAKER_COOLDOWN * 2 ** (self.trips - 1))
+                self.open_until = max(self.open_until, now + cooldown)
+                self.last_trip_error = msg
+            BREAKER_TRIPS.inc()
+            print(f"[BREAKER] YouTube rate-limit, pausing extraction {cooldown:.0f}s: {msg[:120]}")
+            return
+        with self.lock:
+            e = self.entries.get(url) or {"fails": 0}
+            e["fails"] += 1
+            e["error"] = msg
+            e["until"] = now + min(FAILURE_BACKOFF_MAX, FAILURE_BACKOFF_BASE * 2 ** (e["fails"] - 1))
+            self.entries[url] = e
+        print(f"[FAILURES] {url} quarantined {e['until'] - now:.0f}s (x{e['fails']}): {msg[:120]}")
+        self.save()
+
+    def succeeded(self, url: str):
+        # أي نجاح بعد القاطع بيرجّع العداد من الأول
+        if self.trips and self.open_until <= time.time():
+            self.trips = 0
+        if url in self.entries:
+            with self.lock:
+                self.entries.pop(url, None)
+            self.save()
+
+    def listing(self) -> List[Tuple[str, dict]]:
+        now = time.time()
+        return sorted(((u, e) for u, e in self.entries.items() if e["until"] > now), key=lambda x: x[1]["until"])
+
+FAILURES = FailureRegistry(FAILURES_PATH)
+
+def quarantine_report(limit: int = 10) -> str:
+    now = time.time()
+    lines = []
+    if FAILURES.open_until > now:
+        lines.append(f"⛔ الاستخراج موقف {int(FAILURES.open_until - now)} ثانية (يوتيوب عم يحدّ الطلبات): `{FAILURES.last_trip_error[:100]}`")
+    items = FAILURES.listing()
+    for url, e in items[:limit]:
+        mins = int((e["until"] - now) // 60)
+        lines.append(f"• {track_label(url)[:60]} — x{e['fails']}، باقي {mins} د\n  `{e['error'][:100]}`")
+    if len(items) > limit:
+        lines.append(f"… و {len(items) - limit} كمان")
+    return "\n".join(lines) or "✅ ما في روابط موقوفة."
+
+def skip_quarantined(rotation: "Rotation"):
+    # الروابط الخربانة بالقائمة الافتراضية بتنطّ بدون ما نستخرجها
+    for _ in range(len(DEFAULT_PLAYLIST)):
+        if not FAILURES.quarantined(rotation.peek(1)[0]):
+            return
+        rotation.advance()
+
+async def search_index_refresher():
+    await bot.wait_until_ready()
+    defaults = [u for u in DEFAULT_SONG_URLS if is_search(u)]
+    # أول مرة: بس الناقص، بعدين كل SEARCH_INDEX_REFRESH_HOURS نعيد الكل
+    missing = [q for q in defaults if not SEARCH_INDEX.lookup(q)]
+    if missing:
+        n = await SEARCH_INDEX.refresh(missing)
+        print(f"[SEARCH INDEX] indexed {n}/{len(missing)} default queries")
+    while not bot.is_closed():
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_HOURS * 3600)
+        # بحث المستخدمين (/play) ما منجدده، إذا خرب بينحذف وقت التشغيل
+        cutoff = time.time() - SEARCH_INDEX_REFRESH_HOURS * 3600
+        stale = [q for q in defaults if (SEARCH_INDEX.lookup(q) or {}).get("resolved_at", 0) < cutoff]
+        n = await SEARCH_INDEX.refresh(stale)
+        print(f"[SEARCH INDEX] refreshed {len(stale)} queries, {n} changed")
+
 # =========================
 # موديل الأغاني
 # =========================
@@ -203,10 +1156,523 @@ class Track:
     url: str
     title: str = "Unknown"
     requester: Optional[discord.Member] = None
+    # وين وصلنا بالتشغيل (ثواني) ومدة المقطع إذا معروفة: للكمال بعد انقطاع الستريم
+    position: float = 0.0
+    duration: Optional[float] = None
+    resumes: int = 0
+    # الإدخال الأصلي (ytsearch/رابط القائمة): url بيتبدل برابط الفيديو، بس AUDIO_CACHE مفتاحه هاد
+    source_key: str = ""
+
+    def __post_init__(self):
+        if not self.source_key:
+            self.source_key = self.url
+
+# =========================
+# القائمة الافتراضية: نسخة وحدة مشتركة + مؤشر صغير لكل سيرفر
+# =========================
+DEFAULT_PLAYLIST: Tuple[str, ...] = tuple(DEFAULT_SONG_URLS)
+
+FEISTEL_ROUNDS = 4
+
+def feistel_index(i: int, n: int, key: bytes) -> int:
+    # Feistel صغير على 2^bits >= n بيعطي permutation حقيقي (مش خطوة ثابتة)
+    # واللي بيطلع برا [0, n) منرجع نمرره (cycle-walking) لحد ما يوقع جوا
+    bits = max(2, (n - 1).bit_length())
+    bits += bits & 1
+    half = bits // 2
+    mask = (1 << half) - 1
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for rnd in range(FEISTEL_ROUNDS):
+            f = hashlib.blake2b(bytes((rnd,)) + right.to_bytes(4, "big"), key=key, digest_size=4).digest()
+            left, right = right, left ^ (int.from_bytes(f, "big") & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+class Rotation:
+    # بدل ما ننسخ ونخلط 50 رابط لكل سيرفر: seed + رقم الدورة + مكاننا فيها
+    # كل دورة إلها ترتيب مختلف، ومنعرف الجاي بدون ما نبني أي list
+    __slots__ = ("seed", "cycle", "pos")
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.cycle = 0
+        self.pos = 0
+
+    def index(self, cycle: int, pos: int) -> int:
+        return feistel_index(pos, len(DEFAULT_PLAYLIST), f"{self.seed}:{cycle}".encode())
+
+    def peek(self, k: int = 1) -> List[str]:
+        n = len(DEFAULT_PLAYLIST)
+        out = []
+        cycle, pos = self.cycle, self.pos
+        for _ in range(k):
+            out.append(DEFAULT_PLAYLIST[self.index(cycle, pos)])
+            pos += 1
+            if pos == n:
+                cycle, pos = cycle + 1, 0
+        return out
+
+    def advance(self) -> str:
+        url = DEFAULT_PLAYLIST[self.index(self.cycle, self.pos)]
+        self.pos += 1
+        if self.pos == len(DEFAULT_PLAYLIST):
+            self.cycle, self.pos = self.cycle + 1, 0
+        return url
+
+    def tell(self) -> Tuple[int, int]:
+        return self.cycle, self.pos
+
+def track_label(track_or_url) -> str:
+    # اسم للعرض بدون استخراج: العنوان إذا معروف، وإلا نص البحث أو الرابط
+    if isinstance(track_or_url, Track):
+        if track_or_url.title != "Unknown":
+            return track_or_url.title
+        url = track_or_url.url
+    else:
+        url = track_or_url
+    known = SEARCH_INDEX.lookup(url) if is_search(url) else None
+    if known and known.get("title"):
+        return known["title"]
+    if is_search(url):
+        return url.split(":", 1)[1]
+    return url
+
+# =========================
+# كاش صوت محلي (Ogg/Opus) لقائمة القرآن الافتراضية
+# =========================
+AUDIO_CACHE_ENABLED = (os.getenv("AUDIO_CACHE", "0").strip() == "1")
+AUDIO_CACHE_DIR = os.path.join(DATA_DIR, "audio_cache")
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+AUDIO_CACHE_BITRATE = os.getenv("AUDIO_CACHE_BITRATE", "96k")
+# تقدير حجم ملف قبل ما ننزله (بايت/ثانية) لحد ما يصير عنا ملفات نحسب معدلها الفعلي (~160k Opus يوتيوب)
+AUDIO_CACHE_EST_RATE = 20000
+
+class AudioCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.entries: Dict[str, dict] = {}
+        self.loaded_mtime = 0.0
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            self.loaded_mtime = os.stat(self.index_path).st_mtime
+        except OSError:
+            pass
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            print(f"[AUDIO CACHE] index load failed: {e}")
+            self.entries = {}
+        # ملف انحذف من برا؟ شيله من الفهرس
+        for k in [k for k, e in self.entries.items() if not os.path.exists(self.path(e["file"]))]:
+            del self.entries[k]
+
+    def save(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+        self.loaded_mtime = os.stat(self.index_path).st_mtime
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def maybe_reload(self):
+        # process ثانية (launcher) يمكن نزلت ملفات جديدة
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+        except OSError:
+            return
+        if mtime != self.loaded_mtime:
+            self.load()
+
+    def has(self, key: str) -> bool:
+        # للـ warmer: بدون utime مشان ما يخرب ترتيب الـ LRU
+        entry = self.entries.get(key)
+        return bool(entry) and os.path.exists(self.path(entry["file"]))
+
+    def total_bytes(self) -> int:
+        return sum(e.get("size") or 0 for e in self.entries.values())
+
+    def estimate(self, resolved: ResolvedStream) -> int:
+        sized = [(e["size"], e["duration"]) for e in self.entries.values() if e.get("size") and e.get("duration")]
+        rate = sum(s for s, _ in sized) / sum(d for _, d in sized) if sized else AUDIO_CACHE_EST_RATE
+        return int((resolved.duration or 0) * rate)
+
+    def lookup(self, key: str) -> Optional[ResolvedStream]:
+        entry = self.entries.get(key)
+        if not entry:
+            self.maybe_reload()
+            entry = self.entries.get(key)
+        if not entry:
+            return None
+        p = self.path(entry["file"])
+        try:
+            # LRU: آخر استعمال = mtime
+            os.utime(p)
+        except OSError:
+            del self.entries[key]
+            return None
+        return ResolvedStream(
+            video_url=entry.get("video_url") or key,
+            title=entry.get("title") or "",
+            stream_url=p,
+            expires_at=float("inf"),
+            acodec="opus",
+            local=True,
+            duration=entry.get("duration"),
+        )
+
+    async def fetch(self, key: str, resolved: Optional[ResolvedStream] = None) -> bool:
+        if resolved is None:
+            resolved = await resolve_stream(key)
+        if resolved.is_live:
+            return False
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".ogg"
+        final = self.path(name)
+        tmp = final + ".part"
+        # يوتيوب غالباً بيعطي Opus جاهز، فبس منغير الحاوية
+        codec = ["-c:a", "copy"] if resolved.acodec.startswith("opus") else ["-c:a", "libopus", "-b:a", AUDIO_CACHE_BITRATE]
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+            *FFMPEG_BEFORE.split(), "-i", resolved.stream_url,
+            "-vn", "-map", "0:a:0", *codec, "-f", "ogg", tmp,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, err = await proc.communicate()
+        if proc.returncode != 0:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise RuntimeError(f"ffmpeg exited {proc.returncode}: {err.decode(errors='ignore')[-300:]}")
+        os.replace(tmp, final)
+        self.entries[key] = {
+            "file": name,
+            "title": resolved.title,
+            "video_url": resolved.video_url,
+            "duration": resolved.duration,
+            "size": os.path.getsize(final),
+        }
+        self.save()
+        return True
+
+    def evict(self) -> int:
+        # بس لما الميزانية تنزل (AUDIO_CACHE_MAX_MB): الأقدم استعمالاً بيطلع أول
+        removed = 0
+        files = []
+        total = 0
+        for k, e in self.entries.items():
+            try:
+                st = os.stat(self.path(e["file"]))
+            except OSError:
+                continue
+            total += st.st_size
+            files.append((st.st_mtime, k, st.st_size))
+        files.sort()
+        for _, k, size in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(self.entries[k]["file"]))
+            except OSError:
+                pass
+            del self.entries[k]
+            total -= size
+            removed += 1
+            print(f"[AUDIO CACHE] evicted {k}")
+        if removed:
+            self.save()
+        return removed
+
+AUDIO_CACHE = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB * 1024 * 1024)
+
+async def audio_cache_warmer():
+    await bot.wait_until_ready()
+    # مرة وحدة عند التشغيل؛ بعدها الـ warmer ما بيحذف شي مشان يعمل محل (وإلا كل دورة بتنزّل اللي حذفته اللي قبلها)
+    AUDIO_CACHE.evict()
+    while not bot.is_closed():
+        AUDIO_CACHE.maybe_reload()
+        missing = [u for u in DEFAULT_SONG_URLS if not AUDIO_CACHE.has(u)]
+        done = 0
+        delay = 6 * 3600
+        # وحدة وحدة، مشان ما ناخد كل الـ bandwidth من التشغيل
+        for u in missing:
+            try:
+                resolved = await resolve_stream(u)
+                if AUDIO_CACHE.total_bytes() + AUDIO_CACHE.estimate(resolved) > AUDIO_CACHE.max_bytes:
+                    print(f"[AUDIO CACHE] budget full ({AUDIO_CACHE_MAX_MB} MB), {len(missing) - done} tracks stay on YouTube")
+                    break
+                if await AUDIO_CACHE.fetch(u, resolved):
+                    done += 1
+            except ExtractorBusy as e:
+                # القاطع مفتوح: وقف الدورة وارجع جرب بعد ما يسكر، مش بعد 6 ساعات
+                print(f"[AUDIO CACHE] paused: {e}")
+                delay = max(60.0, e.retry_after)
+                break
+            except Exception as e:
+                print(f"[AUDIO CACHE] failed {u}: {type(e).__name__}: {e}")
+        if missing:
+            print(f"[AUDIO CACHE] cached {done}/{len(missing)} default tracks")
+        await asyncio.sleep(delay)
+
+# كل sources الـ ffmpeg العايشة (للـ metrics)؛ weak مشان ما نمسكها بعد ما تخلص
+FFMPEG_SOURCES: "weakref.WeakSet[discord.FFmpegAudio]" = weakref.WeakSet()
+
+def track_ffmpeg(source):
+    FFMPEG_SOURCES.add(source)
+    return source
+
+def live_ffmpeg_count() -> int:
+    n = 0
+    for src in list(FFMPEG_SOURCES):
+        proc = getattr(src, "_process", None)
+        if proc is not None and proc.poll() is None:
+            n += 1
+    return n
+
+def opus_source(resolved: ResolvedStream, volume: float, start: float = 0.0) -> discord.FFmpegOpusAudio:
+    # Opus أصلاً وما في تغيير صوت؟ انسخ الـ packets بدون decode/encode
+    if volume == 1.0 and resolved.acodec.startswith("opus"):
+        return track_ffmpeg(discord.FFmpegOpusAudio(
+            resolved.stream_url,
+            codec="copy",
+            before_options=resolved.before_options_at(start),
+            options=FFMPEG_OPTS,
+        ))
+    return track_ffmpeg(discord.FFmpegOpusAudio(
+        resolved.stream_url,
+        bitrate=OPUS_BITRATE,
+        before_options=resolved.before_options_at(start),
+        options=f"{FFMPEG_OPTS} -filter:a volume={volume}",
+    ))
+
+async def locate_audio(track: Track) -> ResolvedStream:
+    # ملف محلي إذا موجود، وإلا رابط ستريم من يوتيوب
+    resolved = AUDIO_CACHE.lookup(track.source_key) if AUDIO_CACHE_ENABLED else None
+    if resolved is None:
+        resolved = await resolve_stream(track.url)
+    track.url = resolved.video_url
+    track.title = resolved.title or track.title
+    track.duration = resolved.duration or track.duration
+    return resolved
+
+# =========================
+# وضع الراديو: ffmpeg واحد لكل مقطع، والـ Opus frames بتتوزع على كل السيرفرات
+# =========================
+RADIO_MODE = (os.getenv("RADIO_MODE", "0").strip() == "1")
+RADIO_VOLUME = float(os.getenv("RADIO_VOLUME", str(DEFAULT_VOLUME)))
+# كم frame (كل وحدة 20ms) منخلي بالذاكرة للسيرفرات اللي متأخرة شوي
+RADIO_BUFFER_FRAMES = int(os.getenv("RADIO_BUFFER_FRAMES", "250"))
+
+FRAME_SECONDS = 0.02
+OPUS_SILENCE = b"\xf8\xff\xfe"
+
+class RadioListener(discord.AudioSource):
+    # source خفيف لكل سيرفر، بيقرا من نفس الـ buffer تبع المحطة
+    def __init__(self, station: "RadioStation"):
+        self.station = station
+        self.seq: Optional[int] = None
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        return self.station.frame_for(self)
+
+    def cleanup(self):
+        self.station.unsubscribe(self)
+
+class RadioStation:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.cond = threading.Condition()
+        self.frames: deque = deque(maxlen=RADIO_BUFFER_FRAMES)
+        self.seq = 0  # رقم الـ frame الجاي
+        self.listeners: set = set()
+        self.current: Optional[Track] = None
+        self.source: Optional[discord.AudioSource] = None
+        self.aborted = False
+        self.has_listeners = asyncio.Event()
+        self.track_done = asyncio.Event()
+        self.changed = asyncio.Event()
+        self.rotation = Rotation()
+        self.closed = False
+        self.thread = threading.Thread(target=self._produce, name="radio", daemon=True)
+        self.thread.start()
+        self.task = loop.create_task(self.run())
+
+    # ---- listeners (بتنادى من threads تبع discord voice) ----
+    def subscribe(self) -> RadioListener:
+        listener = RadioListener(self)
+        with self.cond:
+            self.listeners.add(listener)
+        self.loop.call_soon_threadsafe(self.has_listeners.set)
+        return listener
+
+    def unsubscribe(self, listener: RadioListener):
+        with self.cond:
+            self.listeners.discard(listener)
+            empty = not self.listeners
+        if empty:
+            self.loop.call_soon_threadsafe(self.has_listeners.clear)
+
+    def frame_for(self, listener: RadioListener) -> bytes:
+        with self.cond:
+            oldest = self.seq - len(self.frames)
+            if listener.seq is None or listener.seq < oldest:
+                # جديد أو متأخر كتير: ابدأ من البث المباشر
+                listener.seq = self.seq
+            if listener.seq >= self.seq:
+                self.cond.wait(FRAME_SECONDS * 3)
+            if listener.seq >= self.seq:
+                # ما في صوت جاهز (بين مقطعين مثلاً)، لا ترجع b"" لأنها بتوقف التشغيل
+                return OPUS_SILENCE
+            data = self.frames[listener.seq - (self.seq - len(self.frames))]
+            listener.seq += 1
+            return data
+
+    # ---- المنتج: بيقرا من ffmpeg بسرعة الوقت الحقيقي ----
+    def _produce(self):
+        start = 0.0
+        loops = 0
+        while not self.closed:
+            src = self.source
+            if src is None:
+                time.sleep(FRAME_SECONDS * 5)
+                start = 0.0
+                continue
+            if not start:
+                start = time.perf_counter()
+                loops = 0
+
+            with self.cond:
+                idle = not self.listeners
+            try:
+                data = b"" if idle else src.read()
+            except Exception as e:
+                print(f"[RADIO] read failed: {e}")
+                data = b""
+            if not data:
+                self.aborted = idle
+                self.source = None
+                try:
+                    src.cleanup()
+                except Exception:
+                    pass
+                self.loop.call_soon_threadsafe(self.track_done.set)
+                continue
+
+            with self.cond:
+                self.frames.append(data)
+                self.seq += 1
+                self.cond.notify_all()
+
+            loops += 1
+            delay = start + loops * FRAME_SECONDS - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def peek_url(self) -> str:
+        skip_quarantined(self.rotation)
+        return self.rotation.peek(1)[0]
+
+    def next_url(self) -> str:
+        return self.rotation.advance()
+
+    async def run(self):
+        track: Optional[Track] = None
+        while not self.closed:
+            # ما في حدا عم يسمع؟ لا تشغل ffmpeg عالفاضي
+            await self.has_listeners.wait()
+            if track is None:
+                track = Track(url=self.next_url())
+            try:
+                resolved = await locate_audio(track)
+                src = opus_source(resolved, RADIO_VOLUME)
+            except ExtractorBusy as e:
+                # نفس المقطع بعد ما يرجع يوتيوب يقبل طلبات
+                await asyncio.sleep(min(e.retry_after, 60))
+                continue
+            except Exception as e:
+                print(f"[RADIO] skip {track.url}: {type(e).__name__}: {e}")
+                track = None
+                await asyncio.sleep(1)
+                continue
+
+            self.track_done.clear()
+            self.aborted = False
+            self.current = track
+            self.source = src
+            self.changed.set()
+            self.changed = asyncio.Event()
+
+            # جهّز رابط المقطع الجاي وهذا شغال
+            asyncio.create_task(self.warm(self.peek_url()))
+
+            await self.track_done.wait()
+            self.current = None
+            # إذا وقفناه لأنه ما في مستمعين، منعيده أول ما حدا يرجع
+            if not self.aborted:
+                track = None
+
+    async def warm(self, url: str):
+        try:
+            await resolve_stream(url)
+        except Exception as e:
+            print(f"[RADIO] prefetch failed for {url}: {e}")
+
+RADIO: Optional[RadioStation] = None
+
+def get_radio() -> RadioStation:
+    global RADIO
+    if RADIO is None:
+        RADIO = RadioStation(asyncio.get_running_loop())
+    return RADIO
 
 # =========================
 # مشغل لكل سيرفر
 # =========================
+# روم الصوت فاضي (بس بوتات)؟ وقف ffmpeg لين يرجع حدا
+IDLE_SUSPEND = (os.getenv("IDLE_SUSPEND", "1").strip() == "1")
+# كم ثانية منستنى بعد ما يطلع آخر واحد قبل ما نوقف (مشان اللي بيطلع ويرجع بسرعة)
+IDLE_SUSPEND_GRACE = float(os.getenv("IDLE_SUSPEND_GRACE", "20"))
+# مشغل ما عم يشغل شي من هالقد دقيقة => بينحذف مع الـ task تبعه
+PLAYER_IDLE_MINUTES = float(os.getenv("PLAYER_IDLE_MINUTES", "30"))
+# الستريم انقطع قبل آخر المقطع؟ منجيب رابط جديد ومنكمل من نفس الثانية (كم مرة لكل مقطع)
+STREAM_RESUME_RETRIES = int(os.getenv("STREAM_RESUME_RETRIES", "3"))
+# إذا وقف قبل النهاية بأقل من هيك منعتبره خلص طبيعي
+STREAM_RESUME_TOLERANCE = float(os.getenv("STREAM_RESUME_TOLERANCE", "10"))
+
+class PlaybackCounter(discord.AudioSource):
+    # بيعد الـ frames اللي انبعتت => track.position دايماً محدث (من thread الصوت)
+    def __init__(self, inner: discord.AudioSource, track: Track):
+        self.inner = inner
+        self.track = track
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        if data:
+            self.track.position += FRAME_SECONDS
+        return data
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
 class GuildPlayer:
     def __init__(self, bot: commands.Bot, guild: discord.Guild):
         self.bot = bot
@@ -214,102 +1680,391 @@ class GuildPlayer:
         self.queue: asyncio.Queue[Tuple[Track, discord.abc.Messageable]] = asyncio.Queue()
         self.next_event = asyncio.Event()
         self.current: Optional[Track] = None
-        self.volume = 0.6
+        self.volume = DEFAULT_VOLUME
         self.autorefill = True
+        # 24/7: مؤشر بالقائمة المشتركة (الطابور فيه بس طلبات المستخدمين)
+        self.rotation = Rotation()
+        self.default_channel: Optional[discord.abc.Messageable] = None
+        self.lookahead: Optional[Tuple[Tuple[int, int], Track]] = None
+        # look-ahead: نجهز المقطع الجاي وهو الحالي شغال
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self.prefetched: Optional[Tuple[Track, discord.AudioSource]] = None
+        # قياس الفراغ بين نهاية مقطع وبداية اللي بعده (ثواني)
+        self.ended_at: Optional[float] = None
+        self.last_gap: Optional[float] = None
+        self.gap_total = 0.0
+        self.gap_count = 0
+        # وضع الراديو: لما الطابور فاضي منسمع للمحطة المشتركة
+        self.radio = False
+        self.on_radio = False
+        self.radio_channel: Optional[discord.abc.Messageable] = None
+        self.wake = asyncio.Event()
+        # ما في حدا بالروم: ffmpeg مسكر والمقطع الحالي بيرجع من أوله لما حدا يفوت
+        self.suspended = False
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.suspend_handle: Optional[asyncio.TimerHandle] = None
+        self.resume_item: Optional[Tuple[Track, discord.abc.Messageable]] = None
+        self.current_channel: Optional[discord.abc.Messageable] = None
+        self.idle_since: Optional[float] = None
+        # vc.stop() مقصود (skip/suspend)، مش انقطاع
+        self.stopping = False
+        self.closed = False
         self.task = asyncio.create_task(self.player_loop())
 
-    async def refill_defaults(self, channel: discord.abc.Messageable):
-        urls = list(DEFAULT_SONG_URLS)
-        random.shuffle(urls)
-        for u in urls:
-            await self.queue.put((Track(url=u), channel))
+    def start_defaults(self, channel: discord.abc.Messageable):
+        self.autorefill = True
+        self.default_channel = channel
+        self.wake.set()
+
+    @property
+    def rotating(self) -> bool:
+        return self.autorefill and self.default_channel is not None
+
+    def default_track(self) -> Track:
+        # نفس الـ Track اللي انعمله prefetch إذا المؤشر ما تحرك
+        if self.lookahead and self.lookahead[0] == self.rotation.tell():
+            return self.lookahead[1]
+        skip_quarantined(self.rotation)
+        track = Track(url=self.rotation.peek(1)[0])
+        self.lookahead = (self.rotation.tell(), track)
+        return track
+
+    async def next_default(self) -> Tuple[Track, discord.abc.Messageable]:
+        track = self.default_track()
+        self.lookahead = None
+        self.rotation.advance()
+        channel = self.default_channel
+        if self.rotation.pos == 0:
+            try:
+                await channel.send("🔁 خلصت القائمة… رجعت من أولها بترتيب جديد وكملت.")
+            except Exception:
+                pass
+        return track, channel
+
+    def upcoming(self, k: int = 5) -> List[str]:
+        out = [track_label(t) for t, _ in list(self.queue._queue)[:k]]
+        if len(out) < k and self.rotating and not self.radio:
+            out += [track_label(u) for u in self.rotation.peek(k - len(out))]
+        return out
+
+    def start_radio(self, channel: discord.abc.Messageable):
+        self.radio = True
+        self.autorefill = False
+        self.radio_channel = channel
+        self.wake.set()
+
+    def skip(self):
+        vc = self.guild.voice_client
+        if vc and (vc.is_playing() or vc.is_paused()):
+            self.stopping = True
+            vc.stop()
+
+    def cut_short(self, track: Track, err: Optional[Exception]) -> bool:
+        if track.position <= 0 or track.resumes >= STREAM_RESUME_RETRIES:
+            return False
+        if track.duration:
+            return track.duration - track.position > STREAM_RESUME_TOLERANCE
+        return err is not None
+
+    def track_ended(self, track: Track, channel: discord.abc.Messageable, err: Optional[Exception]):
+        stopped, self.stopping = self.stopping, False
+        if not stopped and self.cut_short(track, err):
+            # الرابط غالباً انتهى: رابط جديد ونكمل من وين وقفنا
+            STREAM_CACHE.invalidate(track.url)
+            track.resumes += 1
+            self.resume_item = (track, channel)
+            STREAM_RESUMES.inc()
+            print(f"[RESUME] {self.guild.id}: stream ended at {track.position:.0f}s/{track.duration or 0:.0f}s, resuming ({track.resumes}/{STREAM_RESUME_RETRIES})")
+        self.next_event.set()
+
+    def preempt_radio(self):
+        # طلب /play بيوقف الراديو لهالسيرفر بس، والمحطة بتكمل للباقي
+        vc = self.guild.voice_client
+        if self.on_radio and vc:
+            vc.stop()
+
+    def has_listeners(self) -> bool:
+        vc = self.guild.voice_client
+        if vc is None or not vc.is_connected() or vc.channel is None:
+            return False
+        return any(not m.bot for m in vc.channel.members)
+
+    def schedule_suspend(self):
+        if not IDLE_SUSPEND or self.suspended or self.suspend_handle is not None:
+            return
+        self.suspend_handle = asyncio.get_running_loop().call_later(IDLE_SUSPEND_GRACE, self.suspend_if_empty)
+
+    def suspend_if_empty(self):
+        self.suspend_handle = None
+        if not self.has_listeners():
+            self.suspend()
+
+    def suspend(self):
+        if self.suspended:
+            return
+        self.suspended = True
+        self.resumed.clear()
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.drop_prefetched()
+        vc = self.guild.voice_client
+        if vc and (vc.is_playing() or vc.is_paused()):
+            if not self.on_radio:
+                if self.current is not None:
+                    self.resume_item = (self.current, self.current_channel)
+                # الراديو ما بيمسح stopping بالـ after تبعه، فمنحطه بس للتراكات
+                self.stopping = True
+            vc.stop()
+        print(f"[IDLE] {self.guild.id}: no listeners, suspended")
+
+    def resume(self):
+        if self.suspend_handle is not None:
+            self.suspend_handle.cancel()
+            self.suspend_handle = None
+        if not self.suspended:
+            return
+        self.suspended = False
+        self.idle_since = None
+        self.resumed.set()
+        print(f"[IDLE] {self.guild.id}: listener joined, resumed")
+
+    def destroy(self):
+        if self.suspend_handle is not None:
+            self.suspend_handle.cancel()
+            self.suspend_handle = None
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.drop_prefetched()
+        self.closed = True
+        self.task.cancel()
+
+    async def enqueue_playlist(self, url: str, channel: discord.abc.Messageable, requester: Optional[discord.Member]) -> int:
+        # كل مقطع بينضاف للطابور أول ما توصل صفحته، وبيتستخرج بس لما يجي دوره
+        added = 0
+
+        def _add(vid_url: str, title: Optional[str], duration: Optional[float]):
+            nonlocal added
+            if self.closed:
+                return
+            track = Track(url=vid_url, title=title or "Unknown", requester=requester, duration=duration)
+            self.queue.put_nowait((track, channel))
+            added += 1
+            if added == 1:
+                self.preempt_radio()
+
+        await EXTRACTOR.stream_entries(url, _add, stopped=lambda: self.closed)
+        return added
+
+    async def next_item(self) -> Optional[Tuple[Track, discord.abc.Messageable]]:
+        # None يعني "اسمع للراديو"
+        while True:
+            if self.resume_item is not None:
+                item, self.resume_item = self.resume_item, None
+                return item
+            if not self.queue.empty():
+                return self.queue.get_nowait()
+            if self.radio:
+                return None
+            if self.rotating:
+                return await self.next_default()
+            self.wake.clear()
+            getter = asyncio.ensure_future(self.queue.get())
+            waker = asyncio.ensure_future(self.wake.wait())
+            await asyncio.wait({getter, waker}, return_when=asyncio.FIRST_COMPLETED)
+            waker.cancel()
+            if getter.done():
+                return getter.result()
+            getter.cancel()
+
+    async def play_radio(self):
+        vc = self.guild.voice_client
+        if vc is None or not vc.is_connected():
+            self.radio = False
+            return
+
+        station = get_radio()
+        listener = station.subscribe()
+
+        def _after(err: Optional[Exception]):
+            if err:
+                print(f"[AFTER ERROR] {err}")
+            self.bot.loop.call_soon_threadsafe(self.next_event.set)
+
+        self.on_radio = True
+        vc.play(listener, after=_after)
+        last: Optional[Track] = None
+        try:
+            while not self.next_event.is_set():
+                self.current = station.current
+                if self.current and self.current is not last:
+                    last = self.current
+                    try:
+                        await self.radio_channel.send(f"📻 **Now Playing:** {last.title}")
+                    except Exception:
+                        pass
+                changed = asyncio.ensure_future(station.changed.wait())
+                stopped = asyncio.ensure_future(self.next_event.wait())
+                await asyncio.wait({changed, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+                stopped.cancel()
+        finally:
+            self.on_radio = False
+            self.current = None
+
+    def peek_next(self) -> Optional[Tuple[Track, discord.abc.Messageable]]:
+        # asyncio.Queue ما فيها peek، فبنطل عالـ deque الداخلي
+        if self.resume_item is not None:
+            return self.resume_item
+        if not self.queue.empty():
+            return self.queue._queue[0]
+        if self.rotating and not self.radio:
+            return self.default_track(), self.default_channel
+        return None
+
+    async def prefetch_next(self):
+        nxt = self.peek_next()
+        if not nxt:
+            return
+        track, _ = nxt
+        try:
+            if PREFETCH_FFMPEG:
+                source = await self.create_source(track)
+                self.drop_prefetched()
+                self.prefetched = (track, source)
+            elif not (AUDIO_CACHE_ENABLED and AUDIO_CACHE.lookup(track.source_key)):
+                await resolve_stream(track.url)
+        except Exception as e:
+            # مش مشكلة، player_loop رح يجرب مرة ثانية ويبلّغ بالخطأ
+            print(f"[PREFETCH] {self.guild.id}: {type(e).__name__}: {e}")
+
+    def drop_prefetched(self):
+        if self.prefetched:
+            try:
+                self.prefetched[1].cleanup()
+            except Exception:
+                pass
+            self.prefetched = None
+
+    async def take_prefetched(self, track: Track) -> Optional[discord.AudioSource]:
+        if self.prefetch_task and not self.prefetch_task.done():
+            # wait مش await: لو suspend() لغى الـ prefetch، الـ CancelledError ما بيوصل لـ player_loop
+            await asyncio.wait({self.prefetch_task})
+        if self.prefetched and self.prefetched[0] is track:
+            source = self.prefetched[1]
+            self.prefetched = None
+            return source
+        self.drop_prefetched()
+        return None
+
+    def record_gap(self):
+        if self.ended_at is None:
+            return
+        gap = time.monotonic() - self.ended_at
+        self.ended_at = None
+        self.last_gap = gap
+        self.gap_total += gap
+        self.gap_count += 1
+        GAP_SECONDS.observe(gap)
+        if gap > 2:
+            print(f"[GAP] {self.guild.id}: {gap:.2f}s")
 
     async def player_loop(self):
         await self.bot.wait_until_ready()
         while not self.bot.is_closed():
             self.next_event.clear()
 
-            track, channel = await self.queue.get()
+            if self.suspended:
+                await self.resumed.wait()
+                self.ended_at = None
+
+            if self.peek_next() is None:
+                # ما في شي جاهز، فالانتظار هون مش فراغ تشغيل
+                self.ended_at = None
+            item = await self.next_item()
+            vc = self.guild.voice_client
+            if IDLE_SUSPEND and vc is not None and vc.is_connected() and not self.has_listeners():
+                # الروم فاضي: لا تفتح ffmpeg أصلاً، رجّع المقطع لأول الدور
+                if item is not None:
+                    self.resume_item = item
+                self.suspend()
+                continue
+            if item is None:
+                await self.play_radio()
+                continue
+            track, channel = item
             self.current = track
+            self.current_channel = channel
             vc = self.guild.voice_client
 
             if vc is None or not vc.is_connected():
                 self.current = None
+                self.drop_prefetched()
+                # البوت طالع من الروم: وقف الدوران لين حدا يرجع يطلب
+                self.default_channel = None
                 continue
 
+            if self.autorefill and self.default_channel is None:
+                # بعد آخر طلب بيكمل من القائمة الافتراضية بنفس الروم
+                self.default_channel = channel
+
             try:
-                source = await self.create_source(track)
+                source = await self.take_prefetched(track) or await self.create_source(track)
+            except ExtractorBusy as e:
+                # مش ذنب المقطع: رجّعه لأول الدور واستنى القاطع
+                SOURCE_FAILURES.inc(error=type(e).__name__)
+                self.resume_item = item
+                self.current = None
+                print(f"[BREAKER] {self.guild.id}: waiting {e.retry_after:.0f}s")
+                await asyncio.sleep(min(e.retry_after, 60) + random.uniform(0, 5))
+                continue
             except Exception as e:
+                SOURCE_FAILURES.inc(error=type(e).__name__)
                 try:
                     await channel.send(f"⚠️ ما قدرت أشغل هالمقطع، رح أتجاوز.\nسبب: `{type(e).__name__}: {e}`")
                 except Exception:
                     pass
                 self.current = None
-                if self.queue.empty() and self.autorefill:
-                    await self.refill_defaults(channel)
                 continue
 
-            def _after(err: Optional[Exception]):
+            if self.suspended:
+                # الكل طلع وإحنا عم نجهز المصدر
+                source.cleanup()
+                self.resume_item = item
+                self.current = None
+                continue
+
+            def _after(err: Optional[Exception], track=track, channel=channel):
                 if err:
                     print(f"[AFTER ERROR] {err}")
-                self.bot.loop.call_soon_threadsafe(self.next_event.set)
+                self.ended_at = time.monotonic()
+                self.bot.loop.call_soon_threadsafe(self.track_ended, track, channel, err)
 
             vc.play(source, after=_after)
+            self.record_gap()
 
-            try:
-                await channel.send(f"▶️ **Now Playing:** {track.title}")
-            except Exception:
-                pass
-
-            await self.next_event.wait()
-            self.current = None
-
-            if self.queue.empty() and self.autorefill:
-                await self.refill_defaults(channel)
+            if track.resumes == 0 or track.position == 0:
                 try:
-                    await channel.send("🔁 خلصت القائمة… عبّيتها من جديد وكملت.")
+                    await channel.send(f"▶️ **Now Playing:** {track.title}")
                 except Exception:
                     pass
 
-    async def create_source(self, track: Track) -> discord.PCMVolumeTransformer:
-        loop = asyncio.get_running_loop()
+            self.prefetch_task = asyncio.create_task(self.prefetch_next())
+
+            await self.next_event.wait()
+            self.current = None
+
+    async def create_source(self, track: Track) -> discord.AudioSource:
+        resolved = await locate_audio(track)
+        if AUDIO_PATH != "pcm":
+            return PlaybackCounter(opus_source(resolved, self.volume, track.position), track)
 
-        def _extract():
-            with make_ytdl() as ydl:
-                return ydl.extract_info(track.url, download=False)
-
-        info = await loop.run_in_executor(None, _extract)
-        if not info:
-            raise RuntimeError("فشل استخراج معلومات من yt-dlp.")
-
-        # playlist/search
-        if "entries" in info and info["entries"]:
-            entry = next((e for e in info["entries"] if e), None)
-            if not entry:
-                raise RuntimeError("ما لقيت نتيجة صالحة.")
-            vid_url = entry.get("webpage_url") or entry.get("url")
-            if not vid_url:
-                vid = entry.get("id")
-                if not vid:
-                    raise RuntimeError("نتيجة بدون رابط.")
-                vid_url = f"https://www.youtube.com/watch?v={vid}"
-            track.url = vid_url
-            track.title = entry.get("title") or track.title
-            return await self.create_source(track)
-
-        track.title = info.get("title") or track.title
-        stream_url = info.get("url")
-        if not stream_url and info.get("requested_formats"):
-            stream_url = info["requested_formats"][0].get("url")
-        if not stream_url:
-            raise RuntimeError("ما حصلت رابط ستريم صالح.")
-
-        audio = discord.FFmpegPCMAudio(
-            stream_url,
-            before_options=FFMPEG_BEFORE,
+        audio = track_ffmpeg(discord.FFmpegPCMAudio(
+            resolved.stream_url,
+            before_options=resolved.before_options_at(track.position),
             options=FFMPEG_OPTS
-        )
-        return discord.PCMVolumeTransformer(audio, volume=self.volume)
+        ))
+        return PlaybackCounter(discord.PCMVolumeTransformer(audio, volume=self.volume), track)
 
 players: Dict[int, GuildPlayer] = {}
 
@@ -320,6 +2075,43 @@ def get_player(bot: commands.Bot, guild: discord.Guild) -> GuildPlayer:
         players[guild.id] = gp
     return gp
 
+async def destroy_player(guild: discord.Guild, disconnect: bool = False):
+    gp = players.pop(guild.id, None)
+    if gp is not None:
+        gp.destroy()
+    vc = guild.voice_client
+    if disconnect and vc and vc.is_connected():
+        await vc.disconnect()
+
+def player_is_idle(gp: GuildPlayer) -> bool:
+    vc = gp.guild.voice_client
+    if vc is None or not vc.is_connected():
+        return gp.current is None
+    return gp.suspended or (gp.current is None and not gp.on_radio and gp.peek_next() is None)
+
+async def player_janitor():
+    # كل دقيقة: المشغلات اللي صرلها فاضية أكتر من PLAYER_IDLE_MINUTES بتنحذف
+    while True:
+        await asyncio.sleep(60)
+        now = time.monotonic()
+        for gid, gp in list(players.items()):
+            if not player_is_idle(gp):
+                gp.idle_since = None
+                continue
+            if gp.idle_since is None:
+                gp.idle_since = now
+                continue
+            if now - gp.idle_since < PLAYER_IDLE_MINUTES * 60:
+                continue
+            # سيرفرات الـ 24/7 بتضل بالروم (رح نرجع نشغل أول ما يفوت حدا)، الباقي بيطلع
+            keep = bool(get_gcfg(gid).get("autoplay_on_ready"))
+            try:
+                await destroy_player(gp.guild, disconnect=not keep)
+            except Exception as e:
+                print(f"[IDLE] teardown failed in {gid}: {e}")
+                continue
+            print(f"[IDLE] {gid}: player removed after {PLAYER_IDLE_MINUTES:g} min idle")
+
 # =========================
 # آيات/أذكار (نص) + صورة
 # =========================
@@ -356,33 +2148,127 @@ async def ensure_template():
     with open(TEMPLATE_PATH, "wb") as f:
         f.write(data)
 
+_font_warned = False
+
 def pick_font_path() -> str:
+    global _font_warned
+    if FONT_PATH:
+        # محدد صراحة: إذا مش موجود خلي truetype يفشل بصوت عالي، لا تنزل لخط تاني
+        return FONT_PATH
     for p in FALLBACK_FONT_PATHS:
         if os.path.exists(p):
             return p
+    if not _font_warned:
+        _font_warned = True
+        print("[FONT] ما لقيت خط عربي (FONT_PATH أو assets/fonts/Amiri-Regular.ttf)، الكروت رح تنرسم بخط Pillow الافتراضي بدون تشكيل")
     return ""  # will fallback to default
 
+def bench_font_path() -> str:
+    # أرقام الـ bench وحجم الكروت بتعتمد على الخط، وخط Pillow الافتراضي ما بيشكّل عربي: لا تكمل بدونه
+    font_path = pick_font_path()
+    if not font_path or not os.path.exists(font_path):
+        raise SystemExit(f"❌ ما في خط عربي ({font_path or 'ولا واحد من FALLBACK_FONT_PATHS'}). حط FONT_PATH أو assets/fonts/Amiri-Regular.ttf")
+    return os.path.abspath(font_path)
+
 def shape_ar(text: str) -> str:
     reshaped = arabic_reshaper.reshape(text)
-    return get_display(reshaped)
-
-def wrap_lines(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_width: int) -> List[str]:
+    return bidi_algorithm.get_display(reshaped)
+
+# أحجام الخط المجربة من الكبير للصغير
+FONT_SIZES = list(range(44, 18, -2))
+MAX_LINES = 6
+LINE_GAP = 8
+
+@functools.lru_cache(maxsize=64)
+def load_font(font_path: str, size: int) -> ImageFont.ImageFont:
+    # ImageFont.truetype بيقرا ملف الخط كل مرة، فمنخلي نسخة لكل حجم
+    return ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default()
+
+_measure_draw: Optional[ImageDraw.ImageDraw] = None
+
+def measure_draw() -> ImageDraw.ImageDraw:
+    global _measure_draw
+    if _measure_draw is None:
+        _measure_draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    return _measure_draw
+
+@functools.lru_cache(maxsize=65536)
+def text_bbox(font_path: str, size: int, text: str) -> Tuple[int, int, int, int]:
+    return measure_draw().textbbox((0, 0), text, font=load_font(font_path, size))
+
+@functools.lru_cache(maxsize=65536)
+def word_metrics(font_path: str, size: int, word: str) -> Tuple[float, int, int]:
+    # (advance, ink left, ink right) لكلمة وحدة
+    left, _, right, _ = text_bbox(font_path, size, word)
+    if "\n" in word:
+        # getlength ما بيقبل multiline، وهيك أسطر منقيسها كاملة أصلاً
+        return float(right), left, right
+    return load_font(font_path, size).getlength(word), left, right
+
+def wrap_lines(text: str, font_path: str, size: int, max_width: int) -> List[str]:
+    # نفس فكرة التقسيم القديم (عرض السطر كله <= max_width) بس بعروض كلمات محفوظة:
+    # عرض السطر = مجموع advances + مسافات، من أول حبر بأول كلمة لآخر حبر بآخر كلمة
     words = text.split(" ")
+    space = load_font(font_path, size).getlength(" ")
     lines = []
-    cur = ""
+    cur: List[str] = []
+    adv = 0.0  # advance لكل الكلمات بالسطر ما عدا الأخيرة + المسافات
+    first_left = 0
+    last_adv = 0.0
     for w in words:
-        test = (cur + " " + w).strip()
-        bbox = draw.textbbox((0, 0), test, font=font)
-        if (bbox[2] - bbox[0]) <= max_width:
-            cur = test
+        if not w:
+            continue
+        w_adv, w_left, w_right = word_metrics(font_path, size, w)
+        if cur and ("\n" in w or any("\n" in c for c in cur)):
+            # كلمة فيها سطر جديد: textbbox بيقيسها multiline، فمنقيس السطر كامل
+            test = " ".join(cur + [w])
+            bbox = text_bbox(font_path, size, test)
+            width = bbox[2] - bbox[0]
+        elif cur:
+            width = adv + last_adv + space + w_right - first_left
         else:
+            width = w_right - w_left
+        if width <= max_width or not cur:
             if cur:
-                lines.append(cur)
-            cur = w
+                adv += last_adv + space
+            else:
+                first_left = w_left
+            cur.append(w)
+            last_adv = w_adv
+        else:
+            lines.append(" ".join(cur))
+            cur = [w]
+            adv = 0.0
+            first_left = w_left
+            last_adv = w_adv
     if cur:
-        lines.append(cur)
+        lines.append(" ".join(cur))
     return lines
 
+def layout_text(text: str, font_path: str, box_w: int, box_h: int) -> Optional[Tuple[int, List[str], int]]:
+    # binary search على حجم الخط: أكبر حجم بيركب بالصندوق
+    shaped = shape_ar(text)
+
+    def attempt(size: int) -> Optional[Tuple[List[str], int]]:
+        lines = wrap_lines(shaped, font_path, size, box_w)
+        line_h = text_bbox(font_path, size, "Hg")[3]
+        total_h = len(lines) * (line_h + LINE_GAP) - LINE_GAP
+        if total_h <= box_h and len(lines) <= MAX_LINES:
+            return lines, line_h
+        return None
+
+    lo, hi = 0, len(FONT_SIZES) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        fit = attempt(FONT_SIZES[mid])
+        if fit:
+            best = (FONT_SIZES[mid], *fit)
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    return best
+
 def fit_text_on_box(img: Image.Image, text: str) -> Image.Image:
     base = img.convert("RGBA")
     w, h = base.size
@@ -398,30 +2284,25 @@ def fit_text_on_box(img: Image.Image, text: str) -> Image.Image:
     font_path = pick_font_path()
     draw = ImageDraw.Draw(base)
 
-    # جرّب أحجام خط من كبير لصغير لين يركب
-    for size in range(44, 18, -2):
-        font = ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default()
-
-        shaped = shape_ar(text)
-        lines = wrap_lines(draw, shaped, font, box_w)
-        line_h = draw.textbbox((0, 0), "Hg", font=font)[3]
-        total_h = len(lines) * (line_h + 8) - 8
-
-        if total_h <= box_h and len(lines) <= 6:
-            # ارسم بالوسط
-            y = top + (box_h - total_h) // 2
-            for ln in lines:
-                bbox = draw.textbbox((0, 0), ln, font=font)
-                ln_w = bbox[2] - bbox[0]
-                x = left + (box_w - ln_w) // 2
-                # ظل خفيف
-                draw.text((x + 2, y + 2), ln, font=font, fill=(0, 0, 0, 90))
-                draw.text((x, y), ln, font=font, fill=(20, 20, 20, 255))
-                y += line_h + 8
-            return base
+    best = layout_text(text, font_path, box_w, box_h)
+    if best:
+        size, lines, line_h = best
+        font = load_font(font_path, size)
+        total_h = len(lines) * (line_h + LINE_GAP) - LINE_GAP
+        # ارسم بالوسط
+        y = top + (box_h - total_h) // 2
+        for ln in lines:
+            bbox = text_bbox(font_path, size, ln)
+            ln_w = bbox[2] - bbox[0]
+            x = left + (box_w - ln_w) // 2
+            # ظل خفيف
+            draw.text((x + 2, y + 2), ln, font=font, fill=(0, 0, 0, 90))
+            draw.text((x, y), ln, font=font, fill=(20, 20, 20, 255))
+            y += line_h + LINE_GAP
+        return base
 
     # إذا ما ركب، اكتب مختصر
-    small_font = ImageFont.truetype(font_path, 18) if font_path else ImageFont.load_default()
+    small_font = load_font(font_path, 18)
     shaped = shape_ar(text[:120] + "…")
     bbox = draw.textbbox((0, 0), shaped, font=small_font)
     x = left + (box_w - (bbox[2] - bbox[0])) // 2
@@ -440,7 +2321,135 @@ async def fetch_surah_meta() -> List[dict]:
     surah_meta_cache = j["data"]
     return surah_meta_cache
 
+# =========================
+# نص القرآن محلياً (6236 آية) بدل طلب API لكل بوست
+# =========================
+QURAN_DIR = os.path.join(DATA_DIR, "quran")
+QURAN_API_EDITION = (os.getenv("QURAN_API_EDITION") or "ar.alafasy").strip()
+
+class QuranCorpus:
+    # text.bin: كل الآيات UTF-8 ورا بعض
+    # index.bin: offsets (uint32) => الآية رقم n (global, من 1) = text[off[n-1]:off[n]]
+    # surahs.json: اسم كل سورة وعدد آياتها
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.text = b""
+        self.offsets = array("I")
+        self.names: List[str] = []
+        self.counts: List[int] = []
+        self.starts: List[int] = []  # رقم أول آية بكل سورة (global, من 1)
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.names)
+
+    @property
+    def total(self) -> int:
+        return len(self.offsets) - 1 if self.offsets else 0
+
+    def files(self) -> Tuple[str, str, str]:
+        d = self.directory
+        return os.path.join(d, "text.bin"), os.path.join(d, "index.bin"), os.path.join(d, "surahs.json")
+
+    def load(self) -> bool:
+        text_p, index_p, surahs_p = self.files()
+        try:
+            with open(surahs_p, "r", encoding="utf-8") as f:
+                surahs = json.load(f)
+            with open(text_p, "rb") as f:
+                text = f.read()
+            offsets = array("I")
+            with open(index_p, "rb") as f:
+                offsets.frombytes(f.read())
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"[QURAN] load failed: {e}")
+            return False
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        try:
+            self.set(text, offsets, [x["name"] for x in surahs], [x["ayahs"] for x in surahs])
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            # ملفات ناقصة/مش متطابقة: منتصرف كأنه ما في corpus (بيرجع ينبنى من الـ API)
+            print(f"[QURAN] load failed: {e}")
+            return False
+        return True
+
+    def set(self, text: bytes, offsets: array, names: List[str], counts: List[int]):
+        starts = []
+        n = 1
+        for c in counts:
+            starts.append(n)
+            n += c
+        if n - 1 != len(offsets) - 1 or offsets[-1] != len(text):
+            raise ValueError("quran corpus index mismatch")
+        self.text, self.offsets, self.names, self.counts, self.starts = text, offsets, names, counts, starts
+
+    def build(self, surahs: List[Tuple[str, List[str]]]):
+        os.makedirs(self.directory, exist_ok=True)
+        chunks = []
+        offsets = array("I", [0])
+        pos = 0
+        for _, ayat in surahs:
+            for t in ayat:
+                b = t.encode("utf-8")
+                chunks.append(b)
+                pos += len(b)
+                offsets.append(pos)
+        text = b"".join(chunks)
+        names = [n for n, _ in surahs]
+        counts = [len(a) for _, a in surahs]
+        self.set(text, offsets, names, counts)
+
+        text_p, index_p, surahs_p = self.files()
+        disk = array("I", offsets)
+        if sys.byteorder != "little":
+            disk.byteswap()
+        for path, data in ((text_p, text), (index_p, disk.tobytes())):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        # surahs.json آخر شي: إذا موجود يعني الباقي كامل
+        with open(surahs_p + ".tmp", "w", encoding="utf-8") as f:
+            json.dump([{"name": n, "ayahs": c} for n, c in zip(names, counts)], f, ensure_ascii=False)
+        os.replace(surahs_p + ".tmp", surahs_p)
+
+    def ayah(self, number: int) -> Tuple[str, str, int]:
+        # number: رقم الآية بالمصحف كامل (1..6236) => (النص، اسم السورة، رقمها بالسورة)
+        text = self.text[self.offsets[number - 1]:self.offsets[number]].decode("utf-8")
+        s = bisect.bisect_right(self.starts, number) - 1
+        return text, self.names[s], number - self.starts[s] + 1
+
+    def ref(self, surah: int, ayah: int) -> int:
+        return self.starts[surah - 1] + ayah - 1
+
+    def formatted(self, number: int) -> str:
+        return format_ayah(*self.ayah(number))
+
+QURAN = QuranCorpus(QURAN_DIR)
+
+async def fetch_quran() -> List[Tuple[str, List[str]]]:
+    s = await get_session()
+    async with s.get(f"https://api.alquran.cloud/v1/quran/{QURAN_API_EDITION}") as r:
+        r.raise_for_status()
+        j = await r.json()
+    return [(x["name"], [a["text"] for a in x["ayahs"]]) for x in j["data"]["surahs"]]
+
+async def ensure_quran_corpus():
+    if QURAN.loaded:
+        return
+    surahs = await fetch_quran()
+    QURAN.build(surahs)
+    print(f"[QURAN] corpus built: {QURAN.total} ayat in {len(QURAN.names)} surahs")
+
 async def random_ayah_text() -> str:
+    if QURAN.loaded:
+        # نفس التوزيع القديم: سورة عشوائية، بعدين آية عشوائية منها
+        surah = random.randint(1, len(QURAN.names))
+        ayah = random.randint(1, QURAN.counts[surah - 1])
+        return QURAN.formatted(QURAN.ref(surah, ayah))
+
+    # لسا ما في نسخة محلية: الطريقة القديمة من الـ API
     meta = await fetch_surah_meta()
     surah = random.randint(1, 114)
     ayah_count = meta[surah - 1]["numberOfAyahs"]
@@ -451,54 +2460,537 @@ async def random_ayah_text() -> str:
     async with s.get(url) as r:
         r.raise_for_status()
         j = await r.json()
-    text = j["data"]["text"]
-    surah_name = j["data"]["surah"]["name"]
-    num = j["data"]["numberInSurah"]
+    return format_ayah(j["data"]["text"], j["data"]["surah"]["name"], j["data"]["numberInSurah"])
+
+def format_ayah(text: str, surah_name: str, num: int) -> str:
     return f"{text}\n({surah_name} • آية {num})"
 
-async def build_card_image(text: str) -> bytes:
-    await ensure_template()
-    img = Image.open(TEMPLATE_PATH).convert("RGBA")
-    out = fit_text_on_box(img, text)
+# =========================
+# كاش الكروت الجاهزة (ذاكرة + ديسك)
+# =========================
+CARD_CACHE_DIR = os.path.join(DATA_DIR, "cards")
+CARD_CACHE_MEM_ITEMS = int(os.getenv("CARD_CACHE_MEM_ITEMS", "256"))
+CARD_CACHE_MAX_MB = int(os.getenv("CARD_CACHE_MAX_MB", "1024"))
+
+# صيغة الكرت اللي بينرفع: png (القديم) | png-opt | png-quant (256 لون) | webp | jpeg
+CARD_FORMAT = (os.getenv("CARD_FORMAT") or "png").strip().lower()
+CARD_QUALITY = int(os.getenv("CARD_QUALITY", "85"))  # webp/jpeg
+CARD_MAX_WIDTH = int(os.getenv("CARD_MAX_WIDTH", "0"))  # 0 = نفس حجم القالب
+# jpeg ما فيه شفافية، فمنحط القالب على هاللون
+CARD_JPEG_BACKGROUND = (os.getenv("CARD_JPEG_BACKGROUND") or "#ffffff").strip()
+CARD_EXTENSIONS = {"png": ".png", "png-opt": ".png", "png-quant": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+@functools.lru_cache(maxsize=None)
+def card_format() -> str:
+    # بينحسب أول مرة بس (مشان ما نستورد Pillow وقت الإقلاع)
+    fmt = CARD_FORMAT
+    if fmt not in CARD_EXTENSIONS:
+        print(f"[CARD] unknown CARD_FORMAT={fmt!r}, using png")
+        return "png"
+    if fmt == "webp" and not importlib.import_module("PIL.features").check("webp"):
+        print("[CARD] Pillow built without WebP, falling back to jpeg")
+        return "jpeg"
+    return fmt
+
+def card_extension() -> str:
+    return CARD_EXTENSIONS[card_format()]
+
+_template_fp: Optional[Tuple[float, int, str]] = None
+
+def template_fingerprint() -> str:
+    # hash للقالب، بيتحسب مرة وحدة إلا إذا الملف تغير
+    global _template_fp
+    st = os.stat(TEMPLATE_PATH)
+    if _template_fp and _template_fp[:2] == (st.st_mtime, st.st_size):
+        return _template_fp[2]
+    with open(TEMPLATE_PATH, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    _template_fp = (st.st_mtime, st.st_size, digest)
+    return digest
+
+class CardCache:
+    def __init__(self, directory: str, max_items: int, max_bytes: int):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self.disk_bytes: Optional[int] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        parts = [text, template_fingerprint(), pick_font_path(), TEXT_BOX]
+        if card_format() != "png" or CARD_MAX_WIDTH:
+            # png العادي بيضل بنفس المفتاح القديم (الكاش الموجود بيضل صالح)
+            parts.append([card_format(), CARD_QUALITY, CARD_MAX_WIDTH])
+        raw = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + card_extension())
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.mem.get(key)
+        if data is not None:
+            self.mem.move_to_end(key)
+            self.hits += 1
+            return data
+        p = self.path(key)
+        try:
+            with open(p, "rb") as f:
+                data = f.read()
+            os.utime(p)
+        except OSError:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self.remember(key, data)
+        return data
+
+    def remember(self, key: str, data: bytes):
+        self.mem[key] = data
+        self.mem.move_to_end(key)
+        while len(self.mem) > self.max_items:
+            self.mem.popitem(last=False)
+
+    def put(self, key: str, data: bytes):
+        self.remember(key, data)
+        p = self.path(key)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp = p + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, p)
+        if self.disk_bytes is None:
+            self.disk_bytes = self.scan()[1]
+        else:
+            self.disk_bytes += len(data)
+        if self.disk_bytes > self.max_bytes:
+            self.evict()
+
+    def scan(self) -> Tuple[List[Tuple[float, str, int]], int]:
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for n in names:
+                if not n.endswith((".png", ".webp", ".jpg")):
+                    continue
+                p = os.path.join(root, n)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, p, st.st_size))
+                total += st.st_size
+        return files, total
+
+    def evict(self):
+        # نحذف الأقدم استعمالاً لين ننزل لـ 90% من الحد
+        files, total = self.scan()
+        files.sort()
+        target = int(self.max_bytes * 0.9)
+        for _, p, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+        self.disk_bytes = total
+
+CARD_CACHE = CardCache(CARD_CACHE_DIR, CARD_CACHE_MEM_ITEMS, CARD_CACHE_MAX_MB * 1024 * 1024)
+
+# =========================
+# رسم الكروت بـ processes منفصلة (Pillow ما بيوقف الـ event loop والصوت)
+# =========================
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))  # 0 = thread بنفس الـ process
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "8"))
+
+# (fingerprint, قالب): الـ workers عايشين طول عمر البوت، فإذا القالب تغير منرجع نفتحه
+_card_template: Optional[Tuple[str, Image.Image]] = None
+
+def card_template() -> Image.Image:
+    global _card_template
+    fp = template_fingerprint()
+    if _card_template is None or _card_template[0] != fp:
+        _card_template = (fp, Image.open(TEMPLATE_PATH).convert("RGBA"))
+    return _card_template[1]
 
-    import io
+def warm_render_worker():
+    # بيشتغل مرة وحدة بكل worker: القالب والخطوط بالذاكرة من البداية
+    try:
+        card_template()
+    except OSError:
+        pass  # القالب لسا ما نزل، رح ينقرا بأول رسم
+    font_path = pick_font_path()
+    for size in FONT_SIZES + [18]:
+        load_font(font_path, size)
+
+def render_worker_ready() -> int:
+    return os.getpid()
+
+def encode_card(img: Image.Image, fmt: Optional[str] = None, quality: int = CARD_QUALITY, max_width: int = CARD_MAX_WIDTH) -> bytes:
+    fmt = fmt or card_format()
+    if max_width and img.width > max_width:
+        img = img.resize((max_width, round(img.height * max_width / img.width)), Image.Resampling.LANCZOS)
     buf = io.BytesIO()
-    out.save(buf, format="PNG")
+    if fmt == "png":
+        img.save(buf, format="PNG")
+    elif fmt == "png-opt":
+        img.save(buf, format="PNG", optimize=True)
+    elif fmt == "png-quant":
+        # القالب ألوانه قليلة: 256 لون (مع الشفافية) بيكفوا وبيصغّروا الملف كتير
+        img.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG", optimize=True)
+    elif fmt == "webp":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        flat = Image.new("RGB", img.size, CARD_JPEG_BACKGROUND)
+        flat.paste(img, mask=img.getchannel("A") if img.mode == "RGBA" else None)
+        flat.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
     return buf.getvalue()
 
-async def post_ayah_to_guild(guild: discord.Guild):
+def render_card(text: str) -> bytes:
+    out = fit_text_on_box(card_template(), text)
+    return encode_card(out)
+
+class RenderPool:
+    def __init__(self, workers: int = RENDER_WORKERS, queue_max: int = RENDER_QUEUE_MAX):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.rendered = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self.executor is None:
+            # spawn مش fork: الـ process الأساسي فيه threads (voice/ytdl) ما بينفع ننسخها
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_render_worker,
+            )
+        return self.executor
+
+    async def warm(self):
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+        if executor is None:
+            await loop.run_in_executor(None, warm_render_worker)
+            return
+        pids = await asyncio.gather(*[loop.run_in_executor(executor, render_worker_ready) for _ in range(self.workers)])
+        print(f"[RENDER] {len(set(pids))} worker(s) ready")
+
+    async def render(self, text: str) -> bytes:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.queue_max)
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        async with self.slots:
+            self.waiting -= 1
+            started = time.monotonic()
+            try:
+                return await loop.run_in_executor(self.get_executor(), render_card, text)
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                took = time.monotonic() - started
+                RENDER_SECONDS.observe(took)
+                self.rendered += 1
+                self.total_time += took
+                self.max_time = max(self.max_time, took)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "waiting": self.waiting,
+            "rendered": self.rendered,
+            "failures": self.failures,
+            "avg_time": self.total_time / (self.rendered or 1),
+            "max_time": self.max_time,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+RENDER_POOL = RenderPool()
+
+async def build_card_image(text: str) -> bytes:
+    await ensure_template()
+    key = CARD_CACHE.key(text)
+    data = CARD_CACHE.get(key)
+    if data is None:
+        data = await RENDER_POOL.render(text)
+        CARD_CACHE.put(key, data)
+    return data
+
+async def prerender_cards():
+    # أمر offline: python main.py prerender
+    await ensure_template()
+    try:
+        await ensure_quran_corpus()
+        texts = [QURAN.formatted(n) for n in range(1, QURAN.total + 1)] + list(AZKAR)
+    finally:
+        if session and not session.closed:
+            await session.close()
+    started = time.monotonic()
+    todo = [t for t in texts if not os.path.exists(CARD_CACHE.path(CARD_CACHE.key(t)))]
+    done = 0
+
+    async def _one(text: str):
+        nonlocal done
+        CARD_CACHE.put(CARD_CACHE.key(text), await RENDER_POOL.render(text))
+        done += 1
+        if done % 250 == 0:
+            print(f"[PRERENDER] {done}/{len(todo)}")
+
+    try:
+        await asyncio.gather(*[_one(t) for t in todo])
+    finally:
+        RENDER_POOL.shutdown()
+    print(f"[PRERENDER] done: {len(todo)} rendered, {len(texts) - len(todo)} already cached, {time.monotonic() - started:.1f}s")
+
+# كل تك: آية/ذكر واحد، يترسم مرة وحدة، وينبعت لكل الرومات
+AYAH_SHARED_TICK = (os.getenv("AYAH_SHARED_TICK", "1").strip() == "1")
+# كم رفع بنفس الوقت (discord.py بيحترم الـ rate-limit buckets لكل روم وبيستنى عالـ 429)
+POST_CONCURRENCY = int(os.getenv("POST_CONCURRENCY", "8"))
+
+last_tick_stats: dict = {}
+
+def ayah_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
     gcfg = get_gcfg(guild.id)
     ch_id = gcfg.get("ayah_channel_id")
     if not ch_id:
-        return
+        return None
     channel = guild.get_channel(int(ch_id))
     if not isinstance(channel, discord.TextChannel):
-        return
+        return None
+    return channel
 
+async def pick_post_text() -> str:
     # آية أو ذكر
     if random.random() < 0.75:
-        text = await random_ayah_text()
-    else:
-        text = random.choice(AZKAR)
+        return await random_ayah_text()
+    return random.choice(AZKAR)
+
+async def send_card(channel: discord.abc.Messageable, img_bytes: bytes):
+    file = discord.File(fp=io.BytesIO(img_bytes), filename="ayah" + card_extension())
+    started = time.monotonic()
+    try:
+        await channel.send(file=file)
+    except Exception:
+        UPLOAD_FAILURES.inc()
+        raise
+    UPLOAD_SECONDS.observe(time.monotonic() - started)
 
+async def post_ayah_to_guild(guild: discord.Guild):
+    channel = ayah_channel(guild)
+    if channel is None:
+        return
+    text = await pick_post_text()
     img_bytes = await build_card_image(text)
+    await send_card(channel, img_bytes)
 
-    file = discord.File(fp=discord.BytesIO(img_bytes), filename="ayah.png")
-    await channel.send(file=file)
+async def upload_card(channels: List[discord.TextChannel], img_bytes: bytes) -> dict:
+    rendered = time.monotonic()
+    slots = asyncio.Semaphore(POST_CONCURRENCY)
+    failed = 0
 
-async def ayah_scheduler():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
+    async def _send(ch: discord.TextChannel):
+        nonlocal failed
+        async with slots:
+            try:
+                await send_card(ch, img_bytes)
+            except Exception as e:
+                failed += 1
+                print(f"[AYAH] failed in {ch.guild.id}: {e}")
+
+    await asyncio.gather(*[_send(ch) for ch in channels])
+    done = time.monotonic()
+    return {
+        "channels": len(channels),
+        "sent": len(channels) - failed,
+        "failed": failed,
+        "bytes": len(img_bytes),
+        "started": rendered,
+        "upload_time": done - rendered,
+    }
+
+async def quran_corpus_loader():
+    # مرة وحدة بس (بعدها بيضل محفوظ بـ DATA_DIR)، وإذا فشل منرجع نجرب
+    delay = 60
+    while not QURAN.loaded:
         try:
-            for g in bot.guilds:
-                try:
-                    await post_ayah_to_guild(g)
-                except Exception as e:
-                    print(f"[AYAH] failed in {g.id}: {e}")
+            await ensure_quran_corpus()
+        except Exception as e:
+            print(f"[QURAN] build failed, retry in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 3600)
+
+async def warm_renderer():
+    try:
+        await ensure_template()
+        await RENDER_POOL.warm()
+    except Exception as e:
+        print(f"[RENDER] warm failed: {e}")
+
+# =========================
+# جدولة البوستات لكل سيرفر (heap حسب موعد كل سيرفر)
+# =========================
+# تفاوت عشوائي (ثواني) على كل موعد مشان ما يتجمعوا كلهم بنفس اللحظة
+AYAH_JITTER_SECONDS = int(os.getenv("AYAH_JITTER_SECONDS", "60"))
+AYAH_MIN_INTERVAL_MINUTES = 5
+AYAH_MAX_INTERVAL_MINUTES = 24 * 60
+
+def ayah_interval_minutes(gcfg: dict) -> int:
+    return int(gcfg.get("ayah_interval_minutes") or POST_INTERVAL_MINUTES)
+
+def ayah_interval_seconds(gcfg: dict) -> float:
+    return max(60.0, ayah_interval_minutes(gcfg) * 60.0)
+
+class AyahScheduler:
+    def __init__(self):
+        self.heap: List[Tuple[float, int]] = []
+        # الموعد الحالي لكل سيرفر؛ أي شي بالـ heap مش مطابق بيتجاهل (lazy delete)
+        self.due: Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        # كرت مشترك (AYAH_SHARED_TICK): بيتجدد مرة كل أقصر فترة مفعلة مهما كان عدد السيرفرات
+        self.shared: Optional[Tuple[float, bytes]] = None
+        # رندر واحد بس وقت ينتهي الكرت، مهما كان في posts متزامنة
+        self.shared_lock = asyncio.Lock()
+
+    def schedule(self, guild_id: int, delay: Optional[float] = None):
+        interval = ayah_interval_seconds(get_gcfg(guild_id))
+        if delay is None:
+            # أول مرة: موعد عشوائي جوا الفترة => الحمل بيتوزع بالتساوي
+            delay = random.uniform(0, interval)
+        due = time.monotonic() + delay
+        self.due[guild_id] = due
+        if self.shared is not None:
+            # فترة أقصر من اللي انحسب عليها الكرت الحالي => قصّر عمره
+            cap = time.monotonic() + max(interval - AYAH_JITTER_SECONDS, interval / 2)
+            if self.shared[0] > cap:
+                self.shared = (cap, self.shared[1])
+        heapq.heappush(self.heap, (due, guild_id))
+        self.wakeup.set()
+
+    def unschedule(self, guild_id: int):
+        self.due.pop(guild_id, None)
+
+    def load(self):
+        for gid in CONFIG.ayah_guild_ids():
+            self.schedule(gid)
+
+    def pop_due(self) -> Tuple[List[int], float]:
+        # بيرجع السيرفرات اللي إجا دورها، أو كم لازم نستنى
+        now = time.monotonic()
+        ready = []
+        while self.heap:
+            due, gid = self.heap[0]
+            if self.due.get(gid) != due:
+                heapq.heappop(self.heap)
+                continue
+            if due > now:
+                return ready, due - now
+            heapq.heappop(self.heap)
+            ready.append(gid)
+            interval = ayah_interval_seconds(get_gcfg(gid))
+            nxt = due + interval + random.uniform(-AYAH_JITTER_SECONDS, AYAH_JITTER_SECONDS)
+            if nxt <= now:
+                # كنا متأخرين كتير (نوم/ضغط): لا تعوض، كمّل من هلق
+                nxt = now + interval
+            self.due[gid] = nxt
+            heapq.heappush(self.heap, (nxt, gid))
+        return ready, 3600.0
+
+    def shared_ttl(self) -> float:
+        # أقصر فترة بين السيرفرات المجدولة، ناقص الـ jitter: سيرفر كل 5 دقايق ما بيشوف نفس الكرت مرتين
+        intervals = [ayah_interval_seconds(get_gcfg(gid)) for gid in self.due]
+        shortest = min(intervals) if intervals else POST_INTERVAL_MINUTES * 60.0
+        return max(shortest - AYAH_JITTER_SECONDS, shortest / 2)
+
+    async def shared_card(self) -> bytes:
+        shared = self.shared
+        if shared is not None and shared[0] > time.monotonic():
+            return shared[1]
+        async with self.shared_lock:
+            # يمكن غيرنا رندر وإحنا مستنيين القفل
+            if self.shared is None or self.shared[0] <= time.monotonic():
+                text = await pick_post_text()
+                img = await build_card_image(text)
+                self.shared = (time.monotonic() + self.shared_ttl(), img)
+            return self.shared[1]
+
+    async def post(self, guild_ids: List[int]):
+        global last_tick_stats
+        channels = []
+        for gid in guild_ids:
+            guild = bot.get_guild(gid)
+            ch = ayah_channel(guild) if guild else None
+            if ch is None:
+                # السيرفر راح (أو مش بهالـ shard) أو الروم انحذف
+                self.unschedule(gid)
+                continue
+            channels.append(ch)
+        if not channels:
+            return
+        try:
+            if AYAH_SHARED_TICK:
+                started = time.monotonic()
+                img_bytes = await self.shared_card()
+                st = await upload_card(channels, img_bytes)
+                st["prepare_time"] = st.pop("started") - started
+                last_tick_stats = st
+                if st["failed"]:
+                    print(f"[AYAH] batch: {st['sent']}/{st['channels']} sent, upload {st['upload_time']:.2f}s")
+            else:
+                for ch in channels:
+                    try:
+                        await post_ayah_to_guild(ch.guild)
+                    except Exception as e:
+                        print(f"[AYAH] failed in {ch.guild.id}: {e}")
         except Exception as e:
             print(f"[AYAH LOOP] {e}")
 
-        await asyncio.sleep(POST_INTERVAL_MINUTES * 60)
+    async def run(self):
+        while not bot.is_closed():
+            ready, wait = self.pop_due()
+            if ready:
+                # ما منستنى الرفع يخلص مشان ما يتأخر باقي المواعيد
+                asyncio.create_task(self.post(ready))
+                continue
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+AYAH_SCHED: Optional[AyahScheduler] = None
+
+async def ayah_scheduler():
+    global AYAH_SCHED
+    await bot.wait_until_ready()
+    AYAH_SCHED = AyahScheduler()
+    AYAH_SCHED.load()
+    await AYAH_SCHED.run()
+
+def reschedule_ayah(guild_id: int):
+    if AYAH_SCHED is not None:
+        gcfg = get_gcfg(guild_id)
+        if gcfg.get("ayah_channel_id"):
+            AYAH_SCHED.schedule(guild_id, ayah_interval_seconds(gcfg))
+        else:
+            AYAH_SCHED.unschedule(guild_id)
 
 # =========================
 # Bot + Intents
@@ -510,7 +3002,42 @@ intents.voice_states = True
 if ENABLE_PREFIX_COMMANDS:
     intents.message_content = True
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+# =========================
+# Sharding
+# =========================
+# AUTO_SHARD=1: AutoShardedBot بعدد الـ shards اللي بينصح فيه Discord
+# SHARD_IDS/SHARD_COUNT: هالـ process بيمسك بس هالـ shards (الـ launcher بيعبيهم)
+def parse_shard_ids(raw: str) -> Optional[List[int]]:
+    ids: List[int] = []
+    for part in (raw or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            ids.extend(range(int(a), int(b) + 1))
+        else:
+            ids.append(int(part))
+    return ids or None
+
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS", ""))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0) or None
+AUTO_SHARD = (os.getenv("AUTO_SHARD", "0").strip() == "1")
+# رقم الـ process عند التشغيل بالـ launcher (0 = الأساسي، هو اللي بيعمل شغل الخلفية المشترك)
+PROCESS_INDEX = int(os.getenv("PROCESS_INDEX", "0"))
+IS_PRIMARY = PROCESS_INDEX == 0
+
+if SHARD_IDS and not SHARD_COUNT:
+    raise SystemExit("❌ SHARD_IDS needs SHARD_COUNT.")
+
+if AUTO_SHARD or SHARD_IDS or SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix=PREFIX,
+        intents=intents,
+        shard_ids=SHARD_IDS,
+        shard_count=SHARD_COUNT,
+    )
+else:
+    bot = commands.Bot(command_prefix=PREFIX, intents=intents)
 
 async def ensure_voice_for_member(guild: discord.Guild, member: discord.Member) -> discord.VoiceClient:
     if not member.voice or not member.voice.channel:
@@ -525,12 +3052,260 @@ async def ensure_voice_for_member(guild: discord.Guild, member: discord.Member)
 
 async def enqueue_defaults(guild: discord.Guild, reply_target: discord.abc.Messageable):
     player = get_player(bot, guild)
-    player.autorefill = True
-    await player.refill_defaults(reply_target)
+    if RADIO_MODE:
+        player.start_radio(reply_target)
+        return
+    player.start_defaults(reply_target)
+
+async def queue_playlist(player: GuildPlayer, url: str, channel: discord.abc.Messageable, requester: Optional[discord.Member]):
+    try:
+        n = await player.enqueue_playlist(url, channel, requester)
+        msg = f"✅ انضاف {n} مقطع من القائمة." if n else "❌ القائمة فاضية أو ما قدرت أقراها."
+    except Exception as e:
+        msg = f"❌ {e}"
+    try:
+        await channel.send(msg)
+    except Exception:
+        pass
+
+async def voice_members_changed(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    guild = member.guild
+    vc = guild.voice_client
+    if vc is None or not vc.is_connected() or vc.channel is None:
+        return
+    gp = players.get(guild.id)
+    if member.bot:
+        # البوت نفسه انتقل لروم ثاني
+        if bot.user and member.id == bot.user.id and gp and after.channel is not None:
+            if gp.has_listeners():
+                gp.resume()
+            else:
+                gp.schedule_suspend()
+        return
+    ch = vc.channel
+    if after.channel == ch and before.channel != ch:
+        if gp is not None:
+            gp.resume()
+            return
+        # المشغل انحذف وهو فاضي: رجّع الـ 24/7
+        if get_gcfg(guild.id).get("autoplay_on_ready"):
+            await enqueue_defaults(guild, guild.system_channel or (guild.text_channels[0] if guild.text_channels else None))
+    elif before.channel == ch and after.channel != ch and gp is not None and not gp.has_listeners():
+        gp.schedule_suspend()
+
+# =========================
+# مزامنة الأوامر + رجعة الصوت بعد الريستارت
+# =========================
+FORCE_COMMAND_SYNC = (os.getenv("FORCE_COMMAND_SYNC", "0").strip() == "1")
+VOICE_RESTORE_CONCURRENCY = int(os.getenv("VOICE_RESTORE_CONCURRENCY", "8"))
+VOICE_RESTORE_RETRIES = int(os.getenv("VOICE_RESTORE_RETRIES", "6"))
+
+def command_tree_hash(guild: Optional[discord.abc.Snowflake]) -> str:
+    cmds = sorted(
+        (c.to_dict(bot.tree) for c in bot.tree.get_commands(guild=guild)),
+        key=lambda d: (d.get("type", 1), d["name"]),
+    )
+    raw = json.dumps(cmds, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def sync_command_tree():
+    sync_guild_id = (os.getenv("SYNC_GUILD_ID") or "").strip()
+    guild_obj = discord.Object(id=int(sync_guild_id)) if sync_guild_id.isdigit() else None
+    target = f"{bot.application_id}:{sync_guild_id or 'global'}"
+    digest = command_tree_hash(guild_obj)
+    if not FORCE_COMMAND_SYNC and CONFIG.get_meta(f"command_hash:{target}") == digest:
+        print("[SYNC] commands unchanged, skipped")
+        return
+    try:
+        await bot.tree.sync(guild=guild_obj)
+        CONFIG.set_meta(f"command_hash:{target}", digest)
+        if guild_obj is not None:
+            print(f"[SYNC] synced to guild {sync_guild_id}")
+        else:
+            print("[SYNC] synced globally (قد تاخذ وقت لتظهر ببعض السيرفرات)")
+    except Exception as e:
+        print(f"[SYNC ERROR] {e}")
+
+async def restore_guild_voice(guild: discord.Guild) -> bool:
+    gcfg = get_gcfg(guild.id)
+    vch = gcfg.get("voice_channel_id")
+    if not (gcfg.get("autoplay_on_ready") and vch):
+        return False
+    ch = guild.get_channel(int(vch))
+    if not isinstance(ch, discord.VoiceChannel):
+        return False
+    vc = guild.voice_client
+    if not (vc and vc.is_connected()):
+        await ch.connect()
+    # شغل تلقائي
+    await enqueue_defaults(guild, guild.system_channel or (guild.text_channels[0] if guild.text_channels else None))
+    print(f"[AUTO] joined {ch.name} in {guild.name}")
+    return True
+
+async def retry_guild_voice(guild_id: int):
+    for attempt in range(1, VOICE_RESTORE_RETRIES + 1):
+        # backoff أُسّي مع jitter
+        await asyncio.sleep(min(600, 5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            return
+        try:
+            await restore_guild_voice(guild)
+            return
+        except Exception as e:
+            VOICE_EVENTS.inc(event="restore_failed")
+            print(f"[AUTO] retry {attempt}/{VOICE_RESTORE_RETRIES} failed in {guild.name}: {e}")
+
+async def restore_voice():
+    started = time.monotonic()
+    slots = asyncio.Semaphore(VOICE_RESTORE_CONCURRENCY)
+    ids = [gid for gid in CONFIG.autoplay_guild_ids() if bot.get_guild(gid)]
+    ok = 0
+
+    async def _one(gid: int):
+        nonlocal ok
+        # jitter صغير مشان ما نضرب الـ voice gateway كلنا بنفس اللحظة
+        await asyncio.sleep(random.uniform(0, min(5.0, len(ids) / 50)))
+        guild = bot.get_guild(gid)
+        if guild is None:
+            return
+        async with slots:
+            try:
+                if await restore_guild_voice(guild):
+                    ok += 1
+            except Exception as e:
+                VOICE_EVENTS.inc(event="restore_failed")
+                print(f"[AUTO] failed in {guild.name}: {e}")
+                bot.loop.create_task(retry_guild_voice(gid))
+
+    await asyncio.gather(*[_one(gid) for gid in ids])
+    if ids:
+        print(f"[AUTO] restored {ok}/{len(ids)} voice channels in {time.monotonic() - started:.1f}s")
+    STARTUP.mark("voice restore")
+    STARTUP.report()
+
+# =========================
+# Metrics endpoint (اختياري: METRICS_PORT)
+# =========================
+def stat_gauge(name: str, help_text: str, fn) -> Gauge:
+    # بيحوّل dict تبع stats() لـ gauge وحدة مع label اسمه stat
+    def _collect():
+        return {(("stat", k),): float(v) for k, v in fn().items() if isinstance(v, (int, float))}
+    return Gauge(name, help_text, _collect)
+
+def player_states() -> dict:
+    counts = {"playing": 0, "radio": 0, "suspended": 0, "idle": 0}
+    for gp in players.values():
+        if gp.suspended:
+            counts["suspended"] += 1
+        elif gp.on_radio:
+            counts["radio"] += 1
+        elif gp.current is not None:
+            counts["playing"] += 1
+        else:
+            counts["idle"] += 1
+    return {(("state", k),): v for k, v in counts.items()}
+
+def card_cache_stats() -> dict:
+    return {
+        "mem_items": len(CARD_CACHE.mem),
+        "hits": CARD_CACHE.hits,
+        "disk_hits": CARD_CACHE.disk_hits,
+        "misses": CARD_CACHE.misses,
+    }
+
+Gauge("quranbot_guilds", "Guilds seen by this process", lambda: len(bot.guilds))
+Gauge("quranbot_players", "GuildPlayers by state", player_states)
+Gauge("quranbot_queue_depth", "Tracks waiting in all guild queues", lambda: sum(gp.queue.qsize() for gp in players.values()))
+Gauge("quranbot_queue_depth_max", "Deepest single guild queue", lambda: max((gp.queue.qsize() for gp in players.values()), default=0))
+Gauge("quranbot_ffmpeg_processes", "Live ffmpeg playback processes", live_ffmpeg_count)
+Gauge("quranbot_quarantined_urls", "URLs in extraction backoff", lambda: len(FAILURES.listing()))
+Gauge("quranbot_extract_breaker_open", "1 while extraction is paused for YouTube rate-limiting", lambda: int(FAILURES.open_until > time.time()))
+Gauge("quranbot_radio_listeners", "Guilds listening to the shared radio", lambda: len(RADIO.listeners) if RADIO else 0)
+LOOP_LAG_LAST = Gauge("quranbot_event_loop_lag_last_seconds", "Last measured event loop lag")
+stat_gauge("quranbot_extractor", "ExtractorPool.stats()", lambda: EXTRACTOR.stats())
+stat_gauge("quranbot_stream_cache", "StreamCache.stats()", lambda: STREAM_CACHE.stats())
+stat_gauge("quranbot_render_pool", "RenderPool.stats()", lambda: RENDER_POOL.stats())
+stat_gauge("quranbot_card_cache", "CardCache counters", card_cache_stats)
+stat_gauge("quranbot_ayah_last_tick", "Stats of the last shared ayah tick", lambda: last_tick_stats)
+
+LOOP_LAG_INTERVAL = 0.5
+
+async def loop_lag_monitor():
+    # كم تأخر الـ loop عن موعده: أي شي فوق كم ms يعني في شي عم يوقفه (والصوت بيتقطع)
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        LOOP_LAG_LAST.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+
+async def start_metrics_server():
+    from aiohttp import web
+
+    async def _metrics(_request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = METRICS_PORT + PROCESS_INDEX
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        print(f"[METRICS] can't listen on {METRICS_HOST}:{port}: {e}")
+        await runner.cleanup()
+        return
+    bot._metrics_runner = runner
+    print(f"[METRICS] http://{METRICS_HOST}:{port}/metrics")
+
+VOICE_SEEN: set = set()
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    if before.channel != after.channel:
+        await voice_members_changed(member, before, after)
+    if bot.user is None or member.id != bot.user.id:
+        return
+    gid = member.guild.id
+    if before.channel is None and after.channel is not None:
+        VOICE_EVENTS.inc(event="reconnect" if gid in VOICE_SEEN else "connect")
+        VOICE_SEEN.add(gid)
+    elif before.channel is not None and after.channel is None:
+        VOICE_EVENTS.inc(event="disconnect")
+    elif before.channel != after.channel:
+        VOICE_EVENTS.inc(event="move")
+
+_bot_close = bot.close
+
+async def close_bot():
+    # atexit ما بيشتغل مع SIGTERM، فمنكتب تعديلات الإعدادات اللي لسا بالـ debounce هون
+    CONFIG.flush()
+    await _bot_close()
+
+bot.close = close_bot
+
+@bot.event
+async def setup_hook():
+    # بيتنادى بعد الـ login وقبل الاتصال بالـ gateway
+    STARTUP.mark("login")
+    try:
+        # SIGTERM (Railway/Render/الـ launcher) بيسكر البوت عادي => close_bot بيكتب الإعدادات المعلقة
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except (NotImplementedError, RuntimeError):
+        pass
+    if METRICS_PORT and not hasattr(bot, "_metrics_runner"):
+        bot.loop.create_task(loop_lag_monitor())
+        await start_metrics_server()
 
 @bot.event
 async def on_ready():
     print(f"[READY] {bot.user} is online.")
+    if not getattr(bot, "_ready_marked", False):
+        bot._ready_marked = True
+        STARTUP.mark("ready")
     if not pick_js_runtimes():
         print("[WARN] ما لقيت Deno/Node. أحيانًا يوتيوب يحتاجهم.")
 
@@ -540,38 +3315,28 @@ async def on_ready():
     except Exception:
         pass
 
-    # Sync slash commands
-    sync_guild_id = (os.getenv("SYNC_GUILD_ID") or "").strip()
-    try:
-        if sync_guild_id.isdigit():
-            guild_obj = discord.Object(id=int(sync_guild_id))
-            await bot.tree.sync(guild=guild_obj)
-            print(f"[SYNC] synced to guild {sync_guild_id}")
-        else:
-            await bot.tree.sync()
-            print("[SYNC] synced globally (قد تاخذ وقت لتظهر ببعض السيرفرات)")
-    except Exception as e:
-        print(f"[SYNC ERROR] {e}")
+    # Sync slash commands (مرة وحدة، وبس إذا الأوامر تغيرت)
+    if not getattr(bot, "_tree_synced", False):
+        bot._tree_synced = True
+        await sync_command_tree()
 
-    # Auto join if configured
-    for g in bot.guilds:
-        gcfg = get_gcfg(g.id)
-        vch = gcfg.get("voice_channel_id")
-        if gcfg.get("autoplay_on_ready") and vch:
-            ch = g.get_channel(int(vch))
-            if isinstance(ch, discord.VoiceChannel):
-                try:
-                    await ch.connect()
-                    # شغل تلقائي
-                    await enqueue_defaults(g, g.system_channel or (g.text_channels[0] if g.text_channels else None))
-                    print(f"[AUTO] joined {ch.name} in {g.name}")
-                except Exception as e:
-                    print(f"[AUTO] failed in {g.name}: {e}")
+    # Auto join if configured (مرة وحدة؛ بعد الـ reconnect الـ voice clients بيرجعوا لحالهم)
+    if not getattr(bot, "_voice_restore_started", False):
+        bot._voice_restore_started = True
+        bot.loop.create_task(restore_voice())
 
     # start scheduler once
     if not hasattr(bot, "_ayah_task_started"):
         bot._ayah_task_started = True
+        bot.loop.create_task(warm_renderer())
+        bot.loop.create_task(quran_corpus_loader())
         bot.loop.create_task(ayah_scheduler())
+        bot.loop.create_task(player_janitor())
+        # شغل مشترك عالديسك: process وحدة بس بتعمله لما نكون مقسمين
+        if IS_PRIMARY:
+            bot.loop.create_task(search_index_refresher())
+            if AUDIO_CACHE_ENABLED:
+                bot.loop.create_task(audio_cache_warmer())
 
 # =========================
 # Slash Commands (تظهر بروفايل البوت)
@@ -592,7 +3357,7 @@ async def join_slash(interaction: discord.Interaction):
 async def leave_slash(interaction: discord.Interaction):
     vc = interaction.guild.voice_client
     if vc and vc.is_connected():
-        await vc.disconnect()
+        await destroy_player(interaction.guild, disconnect=True)
         await interaction.response.send_message("👋 طلعت من الروم.")
     else:
         await interaction.response.send_message("أنا أصلاً مو داخل روم.", ephemeral=True)
@@ -603,9 +3368,14 @@ async def play_slash(interaction: discord.Interaction, query: str):
         await ensure_voice_for_member(interaction.guild, interaction.user)
         player = get_player(bot, interaction.guild)
         q = query.strip()
+        if is_playlist_url(q):
+            await interaction.response.send_message("⏳ عم ضيف مقاطع القائمة للطابور…")
+            asyncio.create_task(queue_playlist(player, q, interaction.channel, interaction.user))
+            return
         if not URL_RE.match(q) and not q.lower().startswith("ytsearch"):
             q = f"ytsearch1:{q}"
         await player.queue.put((Track(url=q, requester=interaction.user), interaction.channel))
+        player.preempt_radio()
         await interaction.response.send_message("✅ انضافت للطابور.")
     except Exception as e:
         await interaction.response.send_message(f"❌ {e}", ephemeral=True)
@@ -619,7 +3389,7 @@ async def playall_slash(interaction: discord.Interaction):
         gcfg = get_gcfg(interaction.guild.id)
         gcfg["voice_channel_id"] = vc.channel.id
         gcfg["autoplay_on_ready"] = True
-        save_config(CFG)
+        save_gcfg(interaction.guild.id)
 
         await enqueue_defaults(interaction.guild, interaction.channel)
         await interaction.response.send_message(f"✅ تم تحميل قائمة القرآن. رح يشتغل 24/7 🔁")
@@ -629,26 +3399,41 @@ async def playall_slash(interaction: discord.Interaction):
 @bot.tree.command(name="skip", description="يتخطى المقطع الحالي")
 async def skip_slash(interaction: discord.Interaction):
     vc = interaction.guild.voice_client
-    if vc and (vc.is_playing() or vc.is_paused()):
-        vc.stop()
+    player = players.get(interaction.guild.id)
+    if player and player.on_radio:
+        await interaction.response.send_message("📻 الراديو مشترك بين السيرفرات، ما بينفع سكيب. استخدم /play لمقطع خاص.", ephemeral=True)
+    elif vc and (vc.is_playing() or vc.is_paused()):
+        if player:
+            player.skip()
+        else:
+            vc.stop()
         await interaction.response.send_message("⏭️ تم السكيب.")
     else:
         await interaction.response.send_message("ما في شي شغال.", ephemeral=True)
 
 @bot.tree.command(name="now", description="شو شغال الآن")
 async def now_slash(interaction: discord.Interaction):
-    player = get_player(bot, interaction.guild)
-    if player.current:
-        await interaction.response.send_message(f"🎶 الآن: **{player.current.title}**")
+    player = players.get(interaction.guild.id)
+    if player and player.current:
+        msg = f"🎶 الآن: **{player.current.title}**"
+        nxt = player.upcoming(5)
+        if nxt:
+            msg += "\n⏭️ الجاي:\n" + "\n".join(f"{i}. {t}" for i, t in enumerate(nxt, 1))
+        await interaction.response.send_message(msg)
     else:
         await interaction.response.send_message("ما في شي شغال حالياً.", ephemeral=True)
 
-@bot.tree.command(name="setayahchannel", description="حدد روم الشات اللي ينزل فيه آيات/أذكار (كل 30 دقيقة)")
+@bot.tree.command(name="quarantine", description="الروابط الموقوفة مؤقتاً لأنها فشلت")
+async def quarantine_slash(interaction: discord.Interaction):
+    await interaction.response.send_message(quarantine_report(), ephemeral=True)
+
+@bot.tree.command(name="setayahchannel", description="حدد روم الشات اللي ينزل فيه آيات/أذكار")
 async def setayahchannel_slash(interaction: discord.Interaction, channel: discord.TextChannel):
     gcfg = get_gcfg(interaction.guild.id)
     gcfg["ayah_channel_id"] = channel.id
-    save_config(CFG)
-    await interaction.response.send_message(f"✅ تم ضبط روم الآيات: {channel.mention}\n(كل {POST_INTERVAL_MINUTES} دقيقة)")
+    save_gcfg(interaction.guild.id)
+    reschedule_ayah(interaction.guild.id)
+    await interaction.response.send_message(f"✅ تم ضبط روم الآيات: {channel.mention}\n(كل {ayah_interval_minutes(gcfg)} دقيقة)")
 
     # جرّب رسالة مباشرة الآن
     try:
@@ -656,6 +3441,19 @@ async def setayahchannel_slash(interaction: discord.Interaction, channel: discor
     except Exception as e:
         await channel.send(f"⚠️ صار خطأ بتجربة الإرسال: `{e}`")
 
+@bot.tree.command(name="setayahinterval", description="كل كم دقيقة تنزل آية/ذكر بروم الآيات")
+async def setayahinterval_slash(interaction: discord.Interaction, minutes: int):
+    if not AYAH_MIN_INTERVAL_MINUTES <= minutes <= AYAH_MAX_INTERVAL_MINUTES:
+        await interaction.response.send_message(
+            f"❌ لازم تكون بين {AYAH_MIN_INTERVAL_MINUTES} و {AYAH_MAX_INTERVAL_MINUTES} دقيقة.", ephemeral=True
+        )
+        return
+    gcfg = get_gcfg(interaction.guild.id)
+    gcfg["ayah_interval_minutes"] = minutes
+    save_gcfg(interaction.guild.id)
+    reschedule_ayah(interaction.guild.id)
+    await interaction.response.send_message(f"✅ صارت الآيات تنزل كل {minutes} دقيقة.")
+
 # =========================
 # Prefix Commands (اختياري)
 # =========================
@@ -669,7 +3467,7 @@ if ENABLE_PREFIX_COMMANDS:
     async def leave(ctx: commands.Context):
         vc = ctx.guild.voice_client
         if vc and vc.is_connected():
-            await vc.disconnect()
+            await destroy_player(ctx.guild, disconnect=True)
             await ctx.reply("👋 طلعت من الروم.")
         else:
             await ctx.reply("أنا أصلاً مو داخل روم.")
@@ -679,9 +3477,14 @@ if ENABLE_PREFIX_COMMANDS:
         await ensure_voice_for_member(ctx.guild, ctx.author)
         player = get_player(bot, ctx.guild)
         q = query.strip()
+        if is_playlist_url(q):
+            await ctx.reply("⏳ عم ضيف مقاطع القائمة للطابور…")
+            asyncio.create_task(queue_playlist(player, q, ctx.channel, ctx.author))
+            return
         if not URL_RE.match(q) and not q.lower().startswith("ytsearch"):
             q = f"ytsearch1:{q}"
         await player.queue.put((Track(url=q, requester=ctx.author), ctx.channel))
+        player.preempt_radio()
         await ctx.reply("✅ انضافت للطابور.")
 
     @bot.command()
@@ -690,7 +3493,7 @@ if ENABLE_PREFIX_COMMANDS:
         gcfg = get_gcfg(ctx.guild.id)
         gcfg["voice_channel_id"] = vc.channel.id
         gcfg["autoplay_on_ready"] = True
-        save_config(CFG)
+        save_gcfg(ctx.guild.id)
 
         await enqueue_defaults(ctx.guild, ctx.channel)
         await ctx.reply("✅ تشغيل القرآن 24/7 🔁")
@@ -699,11 +3502,517 @@ if ENABLE_PREFIX_COMMANDS:
     async def setayahchannel(ctx: commands.Context, channel: discord.TextChannel):
         gcfg = get_gcfg(ctx.guild.id)
         gcfg["ayah_channel_id"] = channel.id
-        save_config(CFG)
+        save_gcfg(ctx.guild.id)
+        reschedule_ayah(ctx.guild.id)
         await ctx.reply(f"✅ تم ضبط روم الآيات: {channel.mention}")
         await post_ayah_to_guild(ctx.guild)
 
+    @bot.command()
+    async def setayahinterval(ctx: commands.Context, minutes: int):
+        if not AYAH_MIN_INTERVAL_MINUTES <= minutes <= AYAH_MAX_INTERVAL_MINUTES:
+            await ctx.reply(f"❌ لازم تكون بين {AYAH_MIN_INTERVAL_MINUTES} و {AYAH_MAX_INTERVAL_MINUTES} دقيقة.")
+            return
+        gcfg = get_gcfg(ctx.guild.id)
+        gcfg["ayah_interval_minutes"] = minutes
+        save_gcfg(ctx.guild.id)
+        reschedule_ayah(ctx.guild.id)
+        await ctx.reply(f"✅ صارت الآيات تنزل كل {minutes} دقيقة.")
+
+    @bot.command()
+    async def quarantine(ctx: commands.Context):
+        await ctx.reply(quarantine_report())
+
+# =========================
+# Benchmarks (offline: بدون شبكة وبدون Discord)
+# =========================
+BENCH_RUNS = int(os.getenv("BENCH_RUNS", "20"))
+BENCH_TEMPLATE_SIZE = (1080, 1080)
+BENCH_CONFIG_SIZES = (1_000, 10_000, 100_000)
+
+# إذا ما في نص القرآن محلياً: أقصر آية، آية متوسطة، وآية الكرسي كنص طويل
+BENCH_BUILTIN_TEXTS = {
+    "short": ("مدهامتان", "الرحمن", 64),
+    "median": ("صراط الذين أنعمت عليهم غير المغضوب عليهم ولا الضالين", "الفاتحة", 7),
+    "long": (
+        "الله لا إله إلا هو الحي القيوم لا تأخذه سنة ولا نوم له ما في السماوات وما في الأرض "
+        "من ذا الذي يشفع عنده إلا بإذنه يعلم ما بين أيديهم وما خلفهم ولا يحيطون بشيء من علمه "
+        "إلا بما شاء وسع كرسيه السماوات والأرض ولا يئوده حفظهما وهو العلي العظيم",
+        "البقرة", 255,
+    ),
+}
+
+def bench_stats(times: List[float]) -> dict:
+    return {
+        "runs": len(times),
+        "median": round(statistics.median(times), 6),
+        "min": round(min(times), 6),
+        "mean": round(statistics.fmean(times), 6),
+    }
+
+def bench_sync(fn, runs: int, setup=None) -> dict:
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return bench_stats(times)
+
+async def bench_async(fn, runs: int, setup=None) -> dict:
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - t)
+    return bench_stats(times)
+
+def bench_texts() -> Tuple[str, Dict[str, str]]:
+    # من نص القرآن المحلي إذا موجود: أقصر/الوسط/أطول آية بعدد الحروف
+    if QURAN.load():
+        by_len = sorted(range(1, QURAN.total + 1), key=lambda n: QURAN.offsets[n] - QURAN.offsets[n - 1])
+        picks = {"short": by_len[0], "median": by_len[len(by_len) // 2], "long": by_len[-1]}
+        return "corpus", {k: QURAN.formatted(n) for k, n in picks.items()}
+    return "builtin", {k: format_ayah(*v) for k, v in BENCH_BUILTIN_TEXTS.items()}
+
+def bench_template(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img = Image.new("RGBA", BENCH_TEMPLATE_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    w, h = BENCH_TEMPLATE_SIZE
+    draw.rounded_rectangle((40, 40, w - 40, h - 40), radius=60, fill=(246, 239, 220, 255), outline=(150, 120, 60, 255), width=12)
+    img.save(path, format="PNG")
+
+def clear_layout_caches():
+    for fn in (load_font, text_bbox, word_metrics):
+        fn.cache_clear()
+
+class BenchYDL:
+    # بديل YoutubeDL: نفس شكل النتائج، بدون شبكة
+    def extract_info(self, url: str, download: bool = False) -> dict:
+        vid = hashlib.sha1(url.encode("utf-8")).hexdigest()[:11]
+        if is_search(url):
+            return {"entries": [{"id": vid, "title": url.split(":", 1)[1], "webpage_url": f"https://www.youtube.com/watch?v={vid}"}]}
+        expire = int(time.time()) + 6 * 3600
+        return {
+            "id": vid,
+            "title": f"Track {vid}",
+            "webpage_url": url,
+            "acodec": "opus",
+            "url": f"https://rr1---sn-bench.googlevideo.com/videoplayback?expire={expire}&id={vid}&itag=251",
+        }
+
+class BenchSource(discord.AudioSource):
+    # بدل FFmpeg*Audio: منقيس شغلنا مش تشغيل ffmpeg
+    def __init__(self, source, **kwargs):
+        self.source = source
+        self.kwargs = kwargs
+
+    def read(self) -> bytes:
+        return b""
+
+    def is_opus(self) -> bool:
+        return True
+
+def bench_render(texts: Dict[str, str], runs: int) -> dict:
+    global _card_template
+    _card_template = None
+    template = card_template()
+    w, h = template.size
+    box_w = int(TEXT_BOX[2] * w) - int(TEXT_BOX[0] * w)
+    box_h = int(TEXT_BOX[3] * h) - int(TEXT_BOX[1] * h)
+    font_path = pick_font_path()
+    out = {}
+    for name, text in texts.items():
+        out[f"layout.{name}.cold"] = bench_sync(lambda: layout_text(text, font_path, box_w, box_h), runs, setup=clear_layout_caches)
+        out[f"layout.{name}.warm"] = bench_sync(lambda: layout_text(text, font_path, box_w, box_h), runs)
+        out[f"fit_text_on_box.{name}"] = bench_sync(lambda: fit_text_on_box(template, text), runs)
+        out[f"render_card.{name}"] = bench_sync(lambda: render_card(text), runs)
+        out[f"render_card.{name}"]["bytes"] = len(render_card(text))
+    return out
+
+async def bench_cards(texts: Dict[str, str], runs: int) -> dict:
+    RENDER_POOL.workers = 0  # نفس الـ process، مشان الأرقام ما تتأثر بإقلاع الـ workers
+    text = texts["median"]
+    key = CARD_CACHE.key(text)
+
+    def _forget():
+        CARD_CACHE.mem.clear()
+        try:
+            os.remove(CARD_CACHE.path(key))
+        except OSError:
+            pass
+
+    out = {"build_card_image.miss": await bench_async(lambda: build_card_image(text), runs, setup=_forget)}
+    out["build_card_image.disk_hit"] = await bench_async(lambda: build_card_image(text), runs, setup=CARD_CACHE.mem.clear)
+    out["build_card_image.mem_hit"] = await bench_async(lambda: build_card_image(text), runs)
+    RENDER_POOL.shutdown()
+    return out
+
+async def bench_sources(runs: int) -> dict:
+    EXTRACTOR._ydl = lambda flat: BenchYDL()
+    saved = discord.FFmpegOpusAudio, discord.FFmpegPCMAudio
+    discord.FFmpegOpusAudio = discord.FFmpegPCMAudio = BenchSource
+    holder = type("BenchPlayer", (), {"volume": 0.6})()
+    video = "https://www.youtube.com/watch?v=bench000001"
+    search = "ytsearch1:bench quran recitation"
+    out = {}
+    try:
+        def _cold():
+            STREAM_CACHE.entries.clear()
+            SEARCH_INDEX.entries.clear()
+
+        out["create_source.cold"] = await bench_async(lambda: GuildPlayer.create_source(holder, Track(url=video)), runs, setup=_cold)
+        out["create_source.cached"] = await bench_async(lambda: GuildPlayer.create_source(holder, Track(url=video)), runs)
+        out["resolve_stream.search_cold"] = await bench_async(lambda: resolve_stream(search), runs, setup=_cold)
+        out["resolve_stream.search_indexed"] = await bench_async(lambda: resolve_stream(search), runs, setup=STREAM_CACHE.entries.clear)
+        out["resolve_stream.search_cached"] = await bench_async(lambda: resolve_stream(search), runs)
+    finally:
+        discord.FFmpegOpusAudio, discord.FFmpegPCMAudio = saved
+        del EXTRACTOR._ydl
+    return out
+
+def bench_guild_cfg(gid: int) -> dict:
+    g = default_gcfg()
+    if gid % 3 == 0:
+        g["ayah_channel_id"] = gid * 7
+        g["ayah_interval_minutes"] = 30
+    if gid % 5 == 0:
+        g["voice_channel_id"] = gid * 11
+        g["autoplay_on_ready"] = True
+    return g
+
+def bench_config(sizes: Tuple[int, ...], runs: int) -> dict:
+    out = {}
+    for n in sizes:
+        items = [(1_000_000 + i, bench_guild_cfg(1_000_000 + i)) for i in range(n)]
+        reps = max(1, runs // max(1, n // 10_000))
+        path = os.path.join(DATA_DIR, f"bench_{n}.sqlite3")
+
+        def _fresh():
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+
+        def _save_all():
+            store = ConfigStore(path)
+            store.upsert(items)
+            store.close()
+
+        out[f"config.{n}.save_all"] = bench_sync(_save_all, reps, setup=_fresh)
+
+        sample = random.Random(n).sample([gid for gid, _ in items], min(n, 1000))
+
+        def _load():
+            store = ConfigStore(path)
+            store.autoplay_guild_ids()
+            store.ayah_guild_ids()
+            for gid in sample:
+                store.get(gid)
+            store.close()
+
+        out[f"config.{n}.load"] = bench_sync(_load, reps)
+
+        store = ConfigStore(path)
+        gid = items[n // 2][0]
+        CFG[str(gid)] = items[n // 2][1]
+
+        def _save_one():
+            store.mark_dirty(gid)
+            store.flush()
+
+        out[f"config.{n}.save_one"] = bench_sync(_save_one, runs)
+        store.close()
+        CFG.pop(str(gid), None)
+
+        # المرجع القديم: الملف كله JSON بينكتب مع كل تعديل
+        legacy = {str(gid): g for gid, g in items}
+        legacy_path = os.path.join(DATA_DIR, f"bench_{n}.json")
+
+        def _json_save():
+            with open(legacy_path, "w", encoding="utf-8") as f:
+                json.dump(legacy, f, ensure_ascii=False, indent=2)
+
+        out[f"config.{n}.json_save_all"] = bench_sync(_json_save, reps)
+    return out
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+def run_benchmarks(out_path: Optional[str] = None) -> dict:
+    # python main.py bench [out.json]: كل شي بمجلد مؤقت، ما بيلمس data/ الحقيقي
+    global FONT_PATH
+    # مسار كامل مشان يضل صالح بعد الـ chdir للمجلد المؤقت
+    font_path = FONT_PATH = bench_font_path()
+    print(f"[BENCH] font: {font_path}", file=sys.stderr)
+    with open(font_path, "rb") as f:
+        # نفس الاسم بس نسخة تانية من الخط = أرقام مش قابلة للمقارنة
+        font_sha1 = hashlib.sha1(f.read()).hexdigest()[:12]
+    text_source, texts = bench_texts()
+    rev = git_revision()
+    out_path = os.path.abspath(out_path) if out_path else None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="quranbot-bench-") as tmp:
+        os.chdir(tmp)
+        try:
+            ensure_dirs()
+            bench_template(TEMPLATE_PATH)
+            results = bench_render(texts, BENCH_RUNS)
+            results.update(asyncio.run(bench_cards(texts, BENCH_RUNS)))
+            results.update(asyncio.run(bench_sources(BENCH_RUNS)))
+            results.update(bench_config(BENCH_CONFIG_SIZES, max(3, BENCH_RUNS // 4)))
+        finally:
+            os.chdir(cwd)
+    report = {
+        "meta": {
+            "revision": rev,
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "font": os.path.basename(font_path),
+            "font_sha1": font_sha1,
+            "texts": text_source,
+            "template": list(BENCH_TEMPLATE_SIZE),
+            "runs": BENCH_RUNS,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+def compare_benchmarks(old_path: str, new_path: str):
+    # python main.py bench-compare old.json new.json: نسبة الـ median (أقل من 1 = أسرع)
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'benchmark':40} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        a = old["results"].get(name)
+        b = new["results"].get(name)
+        if not a or not b:
+            print(f"{name:40} {'-' if not a else a['median'] * 1000:>10} {'-' if not b else b['median'] * 1000:>10}")
+            continue
+        ratio = b["median"] / a["median"] if a["median"] else float("inf")
+        flag = "  <-- slower" if ratio > 1.10 else ""
+        print(f"{name:40} {a['median'] * 1000:>10.3f} {b['median'] * 1000:>10.3f} {ratio:>7.2f}{flag}")
+
+CARD_REPORT_SAMPLE = int(os.getenv("CARD_REPORT_SAMPLE", "12"))
+
+def card_report_texts() -> List[str]:
+    # عينة ثابتة (seed) من نص القرآن إذا موجود، وإلا النصوص المدمجة + الأذكار
+    if QURAN.load():
+        rng = random.Random(1)
+        return [QURAN.formatted(n) for n in rng.sample(range(1, QURAN.total + 1), min(CARD_REPORT_SAMPLE, QURAN.total))]
+    return [format_ayah(*v) for v in BENCH_BUILTIN_TEXTS.values()] + list(AZKAR)
+
+def card_report(out_path: Optional[str] = None):
+    # python main.py card-report [out.json]: وقت الـ encode وحجم الملف لكل صيغة
+    font_path = bench_font_path()
+    texts = card_report_texts()
+    variants = [("png", 0), ("png-opt", 0), ("png-quant", 0), ("webp", 0), ("jpeg", 0)]
+    if CARD_MAX_WIDTH:
+        variants += [(fmt, CARD_MAX_WIDTH) for fmt, _ in variants]
+    with tempfile.TemporaryDirectory(prefix="quranbot-cards-") as tmp:
+        path = TEMPLATE_PATH
+        if not os.path.exists(path):
+            path = os.path.join(tmp, "template.png")
+            bench_template(path)
+        template = Image.open(path).convert("RGBA")
+        cards = [fit_text_on_box(template, t) for t in texts]
+
+    rows = {}
+    for fmt, width in variants:
+        name = fmt + (f"@{width}w" if width else "")
+        times, sizes = [], []
+        for img in cards:
+            t = time.perf_counter()
+            data = encode_card(img, fmt, CARD_QUALITY, width)
+            times.append(time.perf_counter() - t)
+            sizes.append(len(data))
+        rows[name] = {"encode_median": round(statistics.median(times), 6), "bytes_mean": int(statistics.fmean(sizes)), "bytes_max": max(sizes)}
+
+    base = rows["png"]["bytes_mean"] or 1
+    print(f"{len(cards)} cards, template {template.width}x{template.height}, quality {CARD_QUALITY}, selected {card_format()}")
+    print(f"font {font_path}")
+    print(f"{'format':18} {'encode ms':>10} {'mean KB':>9} {'max KB':>8} {'vs png':>7}")
+    for name, r in rows.items():
+        print(f"{name:18} {r['encode_median'] * 1000:>10.1f} {r['bytes_mean'] / 1024:>9.1f} {r['bytes_max'] / 1024:>8.1f} {r['bytes_mean'] / base:>7.2f}")
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"cards": len(cards), "quality": CARD_QUALITY, "font": os.path.basename(font_path), "results": rows}, f, indent=2)
+
 # =========================
 # Run
 # =========================
-bot.run(DISCORD_TOKEN)
+def recommended_shard_count() -> int:
+    req = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {DISCORD_TOKEN}", "User-Agent": "quran-bot launcher"},
+    )
+    with urllib.request.urlopen(req, timeout=15) as r:
+        return int(json.load(r)["shards"])
+
+def launch_shards(procs: int):
+    # python main.py launch [N]: N processes، كل واحد إله مجموعة shards وplayers وscheduler خاصين فيه
+    total = SHARD_COUNT or recommended_shard_count()
+    procs = max(1, min(procs, total))
+    per, extra = divmod(total, procs)
+    ranges = []
+    start = 0
+    for i in range(procs):
+        n = per + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + n)))
+        start += n
+
+    children: Dict[int, subprocess.Popen] = {}
+    started_at: Dict[int, float] = {}
+    backoff: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(i: int):
+        env = dict(os.environ)
+        env.update(
+            SHARD_IDS=",".join(map(str, ranges[i])),
+            SHARD_COUNT=str(total),
+            PROCESS_INDEX=str(i),
+        )
+        env.pop("AUTO_SHARD", None)
+        children[i] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        started_at[i] = time.monotonic()
+        print(f"[LAUNCH] process {i} (pid {children[i].pid}) shards {ranges[i][0]}-{ranges[i][-1]} of {total}")
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for c in children.values():
+            if c.poll() is None:
+                c.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(procs):
+        spawn(i)
+        # Discord بيسمح بـ identify وحدة كل 5 ثواني (max_concurrency=1)
+        time.sleep(5 * len(ranges[i]) if i + 1 < procs else 0)
+
+    restart_at: Dict[int, float] = {}
+    while children:
+        time.sleep(1)
+        for i, c in list(children.items()):
+            code = c.poll()
+            if code is None:
+                continue
+            if stopping:
+                del children[i]
+                continue
+            if i not in restart_at:
+                # وقع؟ بس shards هالـ process بيتأثروا، منرجع نشغله بـ backoff
+                ran = time.monotonic() - started_at[i]
+                backoff[i] = 5 if ran > 600 else min(300, backoff.get(i, 2.5) * 2)
+                restart_at[i] = time.monotonic() + backoff[i]
+                print(f"[LAUNCH] process {i} exited with {code}, restart in {backoff[i]:.0f}s")
+            elif time.monotonic() >= restart_at[i]:
+                # started_at[i] بيتحدث بـ spawn، فالـ ran الجاي بينحسب من آخر تشغيل
+                del restart_at[i]
+                spawn(i)
+
+def load_state():
+    # كل شي بينقرا من الديسك قبل الاتصال (مش وقت الـ import)
+    CONFIG.open()
+    STARTUP.mark("config")
+    SEARCH_INDEX.load()
+    FAILURES.load()
+    QURAN.load()
+    if AUDIO_CACHE_ENABLED:
+        AUDIO_CACHE.load()
+    STARTUP.mark("state")
+
+def startup_probe():
+    # نفس اللي بيصير قبل الـ login، بدون شبكة
+    load_state()
+    if os.getenv("STARTUP_EAGER") == "1":
+        for m in (yt_dlp, Image, ImageDraw, ImageFont, arabic_reshaper, bidi_algorithm):
+            m._load()
+        STARTUP.mark("heavy imports")
+    print(json.dumps(STARTUP.as_dict()))
+
+def bench_startup(runs: int):
+    # python main.py bench-startup [runs]: cold start بـ process جديدة كل مرة
+    results = {}
+    for mode in ("lazy", "eager"):
+        env = dict(os.environ, STARTUP_EAGER="1" if mode == "eager" else "0")
+        walls = []
+        phases: Dict[str, List[float]] = {}
+        for _ in range(runs):
+            # DATA_DIR مؤقت لكل probe: الـ probe بيفتح/بينقل الإعدادات والفهارس، وما بدنا نلمس data/ الحقيقية
+            tmp = tempfile.mkdtemp(prefix="quran-bot-probe-")
+            try:
+                t = time.perf_counter()
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "startup-probe"],
+                    env=dict(env, DATA_DIR=tmp), capture_output=True, text=True, check=True,
+                )
+                walls.append(time.perf_counter() - t)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            for k, v in json.loads(out.stdout.strip().splitlines()[-1]).items():
+                phases.setdefault(k, []).append(v)
+        results[mode] = {
+            "wall_median": round(statistics.median(walls), 4),
+            "wall_min": round(min(walls), 4),
+            "phases_median": {k: round(statistics.median(v), 4) for k, v in phases.items()},
+        }
+    print(json.dumps({"runs": runs, **results}, indent=2))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["startup-probe"]:
+        startup_probe()
+        raise SystemExit(0)
+
+    if sys.argv[1:2] == ["bench-startup"]:
+        bench_startup(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+        raise SystemExit(0)
+
+    if sys.argv[1:2] == ["bench"]:
+        run_benchmarks(sys.argv[2] if len(sys.argv) > 2 else None)
+        raise SystemExit(0)
+
+    if sys.argv[1:2] == ["bench-compare"] and len(sys.argv) > 3:
+        compare_benchmarks(sys.argv[2], sys.argv[3])
+        raise SystemExit(0)
+
+    if sys.argv[1:2] == ["card-report"]:
+        card_report(sys.argv[2] if len(sys.argv) > 2 else None)
+        raise SystemExit(0)
+
+    load_state()
+
+    if sys.argv[1:2] == ["prerender"]:
+        asyncio.run(prerender_cards())
+        raise SystemExit(0)
+
+    if sys.argv[1:2] == ["launch"]:
+        if not DISCORD_TOKEN:
+            raise SystemExit("❌ DISCORD_TOKEN is missing. Set it in Railway/Render Variables.")
+        launch_shards(int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1))
+        raise SystemExit(0)
+
+    if not DISCORD_TOKEN:
+        raise SystemExit("❌ DISCORD_TOKEN is missing. Set it in Railway/Render Variables.")
+    bot.run(DISCORD_TOKEN)